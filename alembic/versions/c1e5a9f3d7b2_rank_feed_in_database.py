@@ -0,0 +1,63 @@
+"""rank feed in database
+
+Revision ID: c1e5a9f3d7b2
+Revises: a5c7e9d1f3b6
+Create Date: 2024-07-03 14:12:48.371592
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c1e5a9f3d7b2"
+down_revision: str | None = "a5c7e9d1f3b6"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    # the feed orders candidates by cosine distance, see crud.feed.get_user_feed
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+
+    # a video that gets or changes its embedding after it was favorited or added
+    # to a playlist makes the cached sums of those users stale, whoever writes it
+    op.execute(
+        """
+        CREATE FUNCTION invalidate_user_embeddings() RETURNS trigger AS $$
+        BEGIN
+            UPDATE "user"
+            SET embedding_sum = NULL, embedding_count = NULL, embedding_video_ids = NULL
+            WHERE id IN (
+                SELECT user_id FROM favorite WHERE video_id = NEW.id
+                UNION
+                SELECT playlist.user_id FROM playlist_video
+                JOIN playlist ON playlist.id = playlist_video.playlist_id
+                WHERE playlist_video.video_id = NEW.id
+            );
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER video_embedding_written
+        AFTER UPDATE OF embedding ON video
+        FOR EACH ROW
+        WHEN (OLD.embedding IS DISTINCT FROM NEW.embedding)
+        EXECUTE FUNCTION invalidate_user_embeddings()
+        """
+    )
+
+    # sums built before the trigger may already be missing backfilled videos
+    op.execute(
+        'UPDATE "user" SET embedding_sum = NULL, embedding_count = NULL, '
+        "embedding_video_ids = NULL"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER video_embedding_written ON video")
+    op.execute("DROP FUNCTION invalidate_user_embeddings()")
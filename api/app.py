@@ -1,13 +1,24 @@
 import time
-from typing import NamedTuple
-from urllib.parse import parse_qs, urlparse
+from datetime import datetime
 
 import yt_university.config as config
 from fastapi import Body, FastAPI, HTTPException, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from yt_university.config import MAX_JOB_AGE_SECS
+from yt_university.api.ratelimit import (
+    check_rate_limit,
+    concurrency_slot,
+    get_backend,
+    rate_limited,
+)
+from yt_university.config import (
+    BATCH_MAX_CONCURRENCY,
+    CONCURRENCY_RETRY_AFTER_SECS,
+    MAX_INFLIGHT_JOBS,
+    MAX_INFLIGHT_JOBS_PER_USER,
+    SUMMARIZE_MAX_CONCURRENCY,
+)
 from yt_university.crud.playlist import (
     add_playlist,
     add_videos_to_playlist,
@@ -22,12 +33,18 @@ from yt_university.crud.video import (
     get_video,
     upsert_video,
 )
-from yt_university.services.process import process
-from yt_university.services.summarize import categorize_text, generate_summary
-from yt_university.stub import in_progress
+from yt_university.helper import get_youtube_video_id
+from yt_university.models.job import INFLIGHT_STATUSES
+from yt_university.services.process import is_processed
+from yt_university.services.scheduler import submit_job
+from yt_university.services.summarize import categorize_text, summarize_and_categorize
+from yt_university.stub import batches
 
 logger = config.get_logger(__name__)
 
+# a crashed summarize request stops holding its slot after this long
+SUMMARIZE_SLOT_TTL_SECS = 10 * 60
+
 web_app = FastAPI()
 
 web_app.add_middleware(
@@ -44,12 +61,6 @@ class Favorite(BaseModel):
     video_id: str
 
 
-class InProgressJob(NamedTuple):
-    call_id: str
-    start_time: int
-    status: str
-
-
 class WorkflowRequest(BaseModel):
     url: str
     user_id: str
@@ -58,6 +69,12 @@ class WorkflowRequest(BaseModel):
 
 @web_app.post("/api/process")
 async def process_workflow(request: WorkflowRequest):
+    from modal.functions import FunctionCall
+    from yt_university.crud.job import (
+        count_inflight_jobs,
+        get_inflight_job,
+        update_job,
+    )
     from yt_university.database import get_db_session
     from yt_university.models import Video
 
@@ -65,62 +82,201 @@ async def process_workflow(request: WorkflowRequest):
     user_id = request.user_id
     force = request.force
 
-    # Parse the URL to handle different YouTube URL formats
-    parsed = urlparse(url)
-    if "youtu.be" in parsed.netloc:
-        # Handling the shortened YouTube URL format
-        id = parsed.path[1:]  # Skip the first '/' in the path to get the ID
-    else:
-        # Handling the standard YouTube URL format
-        query_params = parse_qs(parsed.query)
-        id = query_params.get("v", [None])[
-            0
-        ]  # Get 'v' parameter or default to None if not present
-
-    # Ensure id is not None before proceeding
-    if id is None:
-        raise ValueError("Invalid YouTube URL provided.")
+    id = get_youtube_video_id(url)
 
     # Reconstruct a sanitized YouTube URL
     sanitized_url = f"https://www.youtube.com/watch?v={id}"
 
-    now = int(time.time())
-    if not force:
-        try:
-            inprogress_job = in_progress[sanitized_url]
-            if (
-                isinstance(inprogress_job, InProgressJob)
-                and (now - inprogress_job.start_time) < MAX_JOB_AGE_SECS
-            ):
-                existing_call_id = inprogress_job.call_id
-                logger.info(
-                    f"Found existing, unexpired call ID {existing_call_id} for video {sanitized_url}"
-                )
-                return {"call_id": existing_call_id}
-        except KeyError:
-            pass
-
     async with get_db_session() as session:
-        video = await get_video(session, id, load_columns=[Video.transcription])
-        if video and video.transcription is not None:
+        video = await get_video(
+            session, id, load_columns=[Video.transcription, Video.checkpoints]
+        )
+        if video and is_processed(video):
             raise HTTPException(status_code=400, detail="Video already processed")
 
-    call = process.spawn(sanitized_url, user_id)
+        existing = await get_inflight_job(session, id)
+        if existing and not force:
+            logger.info(
+                f"Found existing, in-flight job ID {existing.id} for video {sanitized_url}"
+            )
+            return {"call_id": existing.id}
+
+        # only requests that queue work spend a token
+        backend = get_backend(session)
+        await check_rate_limit(backend, "process", user_id)
+
+        if existing:
+            # release the claim so the new job can take it
+            if existing.call_id:
+                FunctionCall.from_id(existing.call_id).cancel()
+            await update_job(
+                session,
+                existing.id,
+                {"status": "cancelled", "finished_at": datetime.utcnow()},
+                from_status=INFLIGHT_STATUSES,
+            )
 
-    in_progress[sanitized_url] = InProgressJob(
-        call_id=call.object_id, start_time=now, status="init"
-    )
+        if (
+            await count_inflight_jobs(session) >= MAX_INFLIGHT_JOBS
+            or await count_inflight_jobs(session, user_id) >= MAX_INFLIGHT_JOBS_PER_USER
+        ):
+            raise rate_limited(CONCURRENCY_RETRY_AFTER_SECS, "Too many jobs in flight")
+
+        # the job id stands in for the call id until the scheduler dispatches it
+        job = await submit_job(
+            session,
+            {
+                "video_id": id,
+                "url": sanitized_url,
+                "user_id": user_id,
+                "duration": video.duration if video else None,
+            },
+        )
+        if job is None:
+            # a concurrent request claimed the video first
+            job = await get_inflight_job(session, id)
+
+    logger.info(f"Queued job ID {job.id}")
+    return {"call_id": job.id}
+
+
+class BatchWorkflowRequest(BaseModel):
+    user_id: str
+    urls: list[str] = []
+    playlist_url: str | None = None
+    max_concurrency: int = BATCH_MAX_CONCURRENCY
 
-    logger.info(f"Started new call ID {call.object_id}")
-    return {"call_id": call.object_id}
+
+@web_app.post("/api/process/batch")
+async def process_batch_workflow(request: BatchWorkflowRequest):
+    """
+    Queue a list of videos and/or every video of a playlist or channel,
+    skipping those already processed or in flight.
+    """
+    from uuid import uuid4
+
+    from sqlalchemy import String, and_, column, func, values
+    from sqlalchemy.future import select
+    from yt_university.database import get_db_session
+    from yt_university.models import Job, Video
+    from yt_university.services.batch import batch_progress
+    from yt_university.services.download import Downloader
+    from yt_university.services.process import stages_complete
+    from yt_university.services.scheduler import submit_jobs
+
+    # checked before listing the playlist, which is already expensive
+    async with get_db_session() as session:
+        await check_rate_limit(get_backend(session), "process", request.user_id)
+
+    ids = []
+    durations = {}
+    if request.playlist_url:
+        entries = Downloader().list_playlist.spawn(request.playlist_url).get()
+        ids.extend(entry["id"] for entry in entries)
+        durations = {entry["id"]: entry["duration"] for entry in entries}
+
+    try:
+        ids.extend(get_youtube_video_id(url) for url in request.urls)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # keep submission order, drop duplicates
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No videos to process")
+
+    batch_id = uuid4().hex
+    max_concurrency = max(1, min(request.max_concurrency, BATCH_MAX_CONCURRENCY))
+
+    async with get_db_session() as session:
+        # one round trip for both existing videos and in-flight jobs
+        requested = values(column("id", String), name="requested").data(
+            [(video_id,) for video_id in ids]
+        )
+        result = await session.execute(
+            select(
+                requested.c.id,
+                Video.checkpoints,
+                # a JSON null is stored for videos that were never transcribed
+                func.json_typeof(Video.transcription) != "null",
+                Job.id,
+            )
+            .select_from(requested)
+            .outerjoin(Video, Video.id == requested.c.id)
+            .outerjoin(
+                Job,
+                and_(
+                    Job.video_id == requested.c.id,
+                    Job.status.in_(INFLIGHT_STATUSES),
+                ),
+            )
+        )
+        skipped = {
+            video_id
+            for video_id, checkpoints, transcribed, job_id in result
+            if job_id or stages_complete(checkpoints, bool(transcribed))
+        }
+
+        claimed = await submit_jobs(
+            session,
+            [
+                {
+                    "video_id": video_id,
+                    "url": f"https://www.youtube.com/watch?v={video_id}",
+                    "user_id": request.user_id,
+                    "duration": durations.get(video_id),
+                    "group": batch_id,
+                    "max_concurrency": max_concurrency,
+                }
+                for video_id in ids
+                if video_id not in skipped
+            ],
+        )
+
+    # videos skipped here, or claimed concurrently elsewhere, have no job
+    videos = dict.fromkeys(ids)
+    videos.update({job.video_id: job.id for job in claimed})
+
+    batch = {"user_id": request.user_id, "created_at": time.time(), "videos": videos}
+    batches[batch_id] = batch
+
+    logger.info(f"Started batch {batch_id} with {len(videos)} videos")
+    async with get_db_session() as session:
+        return await batch_progress(session, batch_id, batch)
+
+
+@web_app.get("/api/process/batch/{batch_id}")
+async def poll_batch(batch_id: str):
+    from yt_university.database import get_db_session
+    from yt_university.services.batch import batch_progress
+
+    try:
+        batch = batches[batch_id]
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    async with get_db_session() as session:
+        return await batch_progress(session, batch_id, batch)
 
 
 @web_app.post("/api/summarize")
-async def invoke_transcription(id: str = Body(..., embed=True)):
+async def invoke_transcription(
+    request: Request,
+    id: str = Body(..., embed=True),
+    no_cache: bool = Body(False, embed=True),
+):
+    """
+    Summarize and categorize a transcribed video. Unless no_cache is set, a
+    summary of the same transcript with the same prompts is reused.
+    """
     from yt_university.database import get_db_session
     from yt_university.models import Video
 
     async with get_db_session() as session:
+        backend = get_backend(session)
+        # the endpoint takes no user, clients are told apart by address
+        await check_rate_limit(backend, "summarize", request.client.host)
+
         video = await get_video(session, id, load_columns=[Video.transcription])
 
         if not video:
@@ -131,17 +287,115 @@ async def invoke_transcription(id: str = Body(..., embed=True)):
                 status_code=404, detail="Transcription not available for this video"
             )
 
-        chunks = video.transcription["chunks"]
+        async with concurrency_slot(
+            backend,
+            "summarize:inflight",
+            SUMMARIZE_MAX_CONCURRENCY,
+            ttl=SUMMARIZE_SLOT_TTL_SECS,
+        ):
+            try:
+                # long transcripts are split on their chunks' timestamps
+                result = summarize_and_categorize.spawn(
+                    video.title, video.transcription, use_cache=not no_cache
+                ).get()
+                if result["category"] is None:
+                    result["category"] = categorize_text.spawn(
+                        video.title, result["summary"], use_cache=not no_cache
+                    ).get()
+            except Exception as e:
+                logger.error(f"Failed to summarize video {video.id}: {e}")
+                raise HTTPException(status_code=502, detail="Failed to summarize video")
+        await upsert_video(session, video.id, result)
+
+        return "DONE"
 
-        full_text = " ".join(chunk["text"] for chunk in chunks)
 
-        summary = generate_summary.spawn(video.title, full_text).get()
-        category = categorize_text.spawn(video.title, summary).get()
-        await upsert_video(
-            session, video.id, {"summary": summary, "category": category}
+def sse_event(event: str, data) -> str:
+    import json
+
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@web_app.get("/api/summarize/{id}/stream")
+async def stream_summary_sections(request: Request, id: str, no_cache: bool = False):
+    """
+    Summarize and categorize a transcribed video like /api/summarize, sending
+    each section of the summary as a server-sent "section" event as soon as it
+    is written. The summary is stored once complete, then a "done" event
+    carries it in markdown with the category. Failures end the stream with an
+    "error" event.
+    """
+    from contextlib import AsyncExitStack
+
+    from fastapi.responses import StreamingResponse
+    from yt_university.database import get_db_session
+    from yt_university.models import Video
+    from yt_university.services.summarize import stream_summary
+
+    # the session and the concurrency slot are held until the stream ends
+    stack = AsyncExitStack()
+    try:
+        session = await stack.enter_async_context(get_db_session())
+        backend = get_backend(session)
+        await check_rate_limit(backend, "summarize", request.client.host)
+
+        video = await get_video(session, id, load_columns=[Video.transcription])
+
+        if not video:
+            raise HTTPException(status_code=404, detail="Video not found")
+
+        if not video.transcription:
+            raise HTTPException(
+                status_code=404, detail="Transcription not available for this video"
+            )
+
+        await stack.enter_async_context(
+            concurrency_slot(
+                backend,
+                "summarize:inflight",
+                SUMMARIZE_MAX_CONCURRENCY,
+                ttl=SUMMARIZE_SLOT_TTL_SECS,
+            )
         )
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    async def events():
+        async with stack:
+            try:
+                async for item in stream_summary.remote_gen.aio(
+                    video.title, video.transcription, use_cache=not no_cache
+                ):
+                    if "section" in item:
+                        yield sse_event("section", item)
+                result = item
+
+                if result["category"] is None:
+                    result["category"] = await categorize_text.remote.aio(
+                        video.title, result["summary"], use_cache=not no_cache
+                    )
+            except Exception as e:
+                logger.error(f"Failed to summarize video {video.id}: {e}")
+                yield sse_event("error", {"detail": "Failed to summarize video"})
+                return
+
+            await upsert_video(session, video.id, result)
+            yield sse_event("done", result)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # proxies must not hold events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-        return "DONE"
+
+@web_app.get("/api/scheduler/metrics")
+async def scheduler_metrics():
+    from yt_university.services.scheduler import get_scheduler_metrics
+
+    return get_scheduler_metrics()
 
 
 @web_app.get("/api/status/{call_id}")
@@ -149,6 +403,22 @@ async def poll_status(call_id: str):
     from modal.call_graph import InputInfo, InputStatus
     from modal.functions import FunctionCall
 
+    if call_id.startswith("job-"):
+        from yt_university.crud.job import get_job
+        from yt_university.database import get_db_session
+
+        async with get_db_session() as session:
+            job = await get_job(session, call_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job.call_id is None:
+            return dict(
+                stage=job.status,
+                status=job.status,
+                waited_secs=(datetime.utcnow() - job.created_at).total_seconds(),
+            )
+        call_id = job.call_id
+
     function_call = FunctionCall.from_id(call_id)
     graph: list[InputInfo] = function_call.get_call_graph()
 
@@ -174,7 +444,10 @@ async def poll_status(call_id: str):
         status=InputStatus(map_root.status).name,
     )
 
-    if map_root.function_name == "services.transcribe.transcribe":
+    if map_root.function_name in (
+        "services.transcribe.transcribe",
+        "services.transcribe.transcribe_stream",
+    ):
         leaves = map_root.children
         tasks = len({leaf.task_id for leaf in leaves})
         done_segments = len(
@@ -195,6 +468,32 @@ async def poll_status(call_id: str):
     return status
 
 
+@web_app.get("/api/cache/stats")
+async def cache_stats():
+    from yt_university.database import get_db_session
+    from yt_university.services.download import get_cache_stats
+    from yt_university.services.summarize import get_llm_cache_stats
+
+    async with get_db_session() as session:
+        return {
+            **await get_cache_stats(session),
+            "llm": await get_llm_cache_stats(session),
+        }
+
+
+@web_app.get("/api/metrics/pipeline")
+async def pipeline_metrics():
+    """
+    Time, tokens and estimated cost of every stage processed so far, with the
+    cost per hour of transcribed audio.
+    """
+    from yt_university.database import get_db_session
+    from yt_university.services.metrics import get_pipeline_metrics
+
+    async with get_db_session() as session:
+        return await get_pipeline_metrics(session)
+
+
 @web_app.get("/api/videos")
 async def all_videos(
     user_id: str = Query(None, description="The user ID to fetch favorites for"),
@@ -220,19 +519,129 @@ async def all_videos(
 
 
 @web_app.get("/api/videos/{id}")
-async def get_individual_video(id: str):
+async def get_individual_video(
+    id: str,
+    sections: str = Query(
+        None,
+        description="Comma-separated summary sections to return, such as tldr,takeaways",
+    ),
+):
     """
     Fetch a video by its ID.
+
+    With sections, only those sections of the summary are loaded, returned
+    under "sections" as the model wrote them and as "summary" in markdown.
     """
     from yt_university.database import get_db_session
+    from yt_university.models import Video
+    from yt_university.services.summarize import (
+        markdown_to_json,
+        render_summary,
+        summary_sections,
+    )
+
+    if sections is None:
+        async with get_db_session() as session:
+            video = await get_video(session, id, load_columns="all")
+
+        if not video:
+            raise HTTPException(status_code=404, detail="Video not found")
+
+        return video
+
+    try:
+        sections = summary_sections(sections)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     async with get_db_session() as session:
-        video = await get_video(session, id, load_columns="all")
+        video = await get_video(session, id, load_columns=[Video.summary_json])
+        if video and video.summary_json is None:
+            # summarized before summary_json was stored, only the markdown is kept
+            video = await get_video(session, id, load_columns=[Video.summary])
 
     if not video:
         raise HTTPException(status_code=404, detail="Video not found")
 
-    return video
+    video_info = video.__dict__.copy()
+    summary_json = video_info.pop("summary_json", None)
+    markdown = video_info.pop("summary", None)
+    if summary_json is None and markdown:
+        summary_json = markdown_to_json(markdown)
+    if summary_json is None:
+        raise HTTPException(
+            status_code=404, detail="Summary sections not available for this video"
+        )
+
+    video_info["sections"] = {
+        section: summary_json.get(section) for section in sections
+    }
+    video_info["summary"] = render_summary(
+        (video.id, video.updated_at), summary_json, sections
+    )
+    return video_info
+
+
+@web_app.get("/api/videos/{id}/transcript")
+async def get_video_transcript(id: str):
+    """
+    Fetch the transcript of a video, including the segments stored so far
+    while it is still being transcribed.
+    """
+    from yt_university.crud.transcript import (
+        assemble_transcription,
+        get_decoded_duration,
+        get_transcript_segments,
+        transcript_gaps,
+    )
+    from yt_university.database import get_db_session
+    from yt_university.models import Video
+
+    async with get_db_session() as session:
+        video = await get_video(session, id, load_columns=[Video.checkpoints])
+        if not video:
+            raise HTTPException(status_code=404, detail="Video not found")
+
+        segments = await get_transcript_segments(session, id)
+        duration = await get_decoded_duration(session, id)
+
+    if duration is None:
+        # until a transcribe stage completes, only the metadata's rounded duration
+        gaps = transcript_gaps(segments, video.duration, duration_error=1.0)
+    else:
+        gaps = transcript_gaps(segments, duration)
+
+    return {
+        "complete": "transcribe" in (video.checkpoints or {}),
+        "segments": len(segments),
+        "gaps": gaps,
+        **assemble_transcription(segments),
+    }
+
+
+@web_app.get("/api/videos/{id}/metrics")
+async def video_metrics(id: str):
+    """
+    Fetch the metrics recorded for each stage of a video, on every run.
+    """
+    from yt_university.crud.metrics import get_video_metrics
+    from yt_university.database import get_db_session
+
+    async with get_db_session() as session:
+        metrics = await get_video_metrics(session, id)
+
+    if not metrics:
+        raise HTTPException(status_code=404, detail="No metrics found")
+
+    return {
+        # segments are already part of their transcribe stage
+        "cost_usd": sum(
+            metric.cost_usd or 0.0
+            for metric in metrics
+            if metric.stage != "transcribe_segment"
+        ),
+        "metrics": [metric.to_dict() for metric in metrics],
+    }
 
 
 @web_app.get("/api/categories")
@@ -294,6 +703,32 @@ async def list_favorites(user_id: str):
         )
 
 
+@web_app.get("/api/users/{user_id}/feed")
+async def user_feed(
+    user_id: str,
+    limit: int = Query(10, description="Number of videos to return"),
+    diversity: float = Query(
+        0.3, ge=0.0, le=1.0, description="Trade-off between relevance and variety"
+    ),
+):
+    """
+    Recommend unseen videos close to the user's favorites and playlists.
+    """
+    from yt_university.crud.feed import get_user_feed
+    from yt_university.database import get_db_session
+
+    try:
+        async with get_db_session() as session:
+            return await get_user_feed(session, user_id, limit, diversity)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Failed to build feed for user {user_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
+        )
+
+
 class CreatePlaylist(BaseModel):
     name: str
     description: str
@@ -0,0 +1,166 @@
+import asyncio
+import contextlib
+import math
+import time
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+
+from yt_university.config import (
+    CONCURRENCY_RETRY_AFTER_SECS,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMITS,
+)
+
+
+def take_token(
+    tokens: float, refilled_at: float, now: float, rate: float, capacity: float
+):
+    """
+    Refill a token bucket up to now and take one token from it.
+
+    Returns the tokens left and how many seconds to wait before retrying,
+    which is 0 when the token was granted.
+    """
+    tokens = min(capacity, tokens + (now - refilled_at) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBackend:
+    """
+    Limiter state local to this process, for tests and local runs.
+    """
+
+    def __init__(self):
+        self.buckets: dict[str, tuple[float, float]] = {}
+        self.leases: dict[str, dict[str, float]] = {}
+        self.lock = asyncio.Lock()
+
+    async def take(self, key: str, rate: float, capacity: float) -> float:
+        async with self.lock:
+            now = time.time()
+            tokens, refilled_at = self.buckets.get(key, (capacity, now))
+            tokens, retry_after = take_token(tokens, refilled_at, now, rate, capacity)
+            self.buckets[key] = (tokens, now)
+            return retry_after
+
+    async def refund(self, key: str, capacity: float):
+        async with self.lock:
+            if key in self.buckets:
+                tokens, refilled_at = self.buckets[key]
+                self.buckets[key] = (min(capacity, tokens + 1), refilled_at)
+
+    async def acquire(self, key: str, limit: int, ttl: float) -> str | None:
+        async with self.lock:
+            now = time.time()
+            leases = self.leases.setdefault(key, {})
+            for lease_id, expires_at in list(leases.items()):
+                if expires_at < now:
+                    del leases[lease_id]
+            if len(leases) >= limit:
+                return None
+
+            lease_id = uuid4().hex
+            leases[lease_id] = now + ttl
+            return lease_id
+
+    async def release(self, key: str, lease_id: str):
+        async with self.lock:
+            self.leases.get(key, {}).pop(lease_id, None)
+
+
+class DatabaseBackend:
+    """
+    Limiter state in Postgres, shared by every web container.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    async def take(self, key: str, rate: float, capacity: float) -> float:
+        from yt_university.crud.rate_limit import get_bucket_for_update
+
+        now = time.time()
+        bucket = await get_bucket_for_update(self.session, key, capacity, now)
+        bucket.tokens, retry_after = take_token(
+            bucket.tokens, bucket.refilled_at, now, rate, capacity
+        )
+        bucket.refilled_at = now
+        await self.session.commit()
+        return retry_after
+
+    async def refund(self, key: str, capacity: float):
+        from yt_university.crud.rate_limit import get_bucket_for_update
+
+        bucket = await get_bucket_for_update(self.session, key, capacity, time.time())
+        bucket.tokens = min(capacity, bucket.tokens + 1)
+        await self.session.commit()
+
+    async def acquire(self, key: str, limit: int, ttl: float) -> str | None:
+        from yt_university.crud.rate_limit import acquire_lease
+
+        return await acquire_lease(self.session, key, limit, ttl, time.time())
+
+    async def release(self, key: str, lease_id: str):
+        from yt_university.crud.rate_limit import release_lease
+
+        await release_lease(self.session, lease_id)
+
+
+memory_backend = MemoryBackend()
+
+
+def get_backend(session):
+    if RATE_LIMIT_BACKEND == "memory":
+        return memory_backend
+    return DatabaseBackend(session)
+
+
+def rate_limited(retry_after: float, detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+async def check_rate_limit(backend, scope: str, user_id: str):
+    """
+    Take a token from the user's and the global bucket of scope, raising a 429
+    if either is empty. A request the global bucket rejects gets the user's
+    token back.
+    """
+    limits = RATE_LIMITS[scope]
+    user_key = f"{scope}:user:{user_id}"
+    user_capacity, user_refill_secs = limits["user"]
+    retry_after = await backend.take(
+        user_key, user_capacity / user_refill_secs, user_capacity
+    )
+    if retry_after:
+        raise rate_limited(retry_after, "Rate limit exceeded")
+
+    capacity, refill_secs = limits["global"]
+    retry_after = await backend.take(
+        f"{scope}:global", capacity / refill_secs, capacity
+    )
+    if retry_after:
+        await backend.refund(user_key, user_capacity)
+        raise rate_limited(retry_after, "Rate limit exceeded")
+
+
+@contextlib.asynccontextmanager
+async def concurrency_slot(backend, key: str, limit: int, ttl: float):
+    """
+    Hold one of limit concurrent slots on key for the duration of the block,
+    raising a 429 if they are all taken.
+    """
+    lease_id = await backend.acquire(key, limit, ttl)
+    if lease_id is None:
+        raise rate_limited(CONCURRENCY_RETRY_AFTER_SECS, "Too many requests in flight")
+
+    try:
+        yield
+    finally:
+        await backend.release(key, lease_id)
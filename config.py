@@ -1,4 +1,5 @@
 import logging
+import os
 
 
 def get_logger(name, level=logging.INFO):
@@ -14,4 +15,84 @@ def get_logger(name, level=logging.INFO):
 
 DATA_DIR = "/data/"
 MODEL_DIR = "/model/"
-MAX_JOB_AGE_SECS = 10 * 60
+AUDIO_CACHE_DIR = f"{DATA_DIR}audio/"
+AUDIO_FORMAT = "bestaudio[ext=m4a]"
+# LLM outputs by prompt and model, see services.summarize.cached_completion
+LLM_CACHE_DIR = f"{DATA_DIR}llm/"
+# in-flight jobs past these ages are expired by services.scheduler.sweep_jobs
+QUEUED_JOB_TTL_SECS = 24 * 60 * 60
+RUNNING_JOB_TTL_SECS = 60 * 60
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+# fair-share scheduling of process jobs, see services.scheduler
+SCHEDULER_MAX_RUNNING = int(os.getenv("SCHEDULER_MAX_RUNNING", "8"))
+SCHEDULER_AGING_SECS = 15 * 60
+# assumed length of videos whose duration is not known yet
+DEFAULT_JOB_DURATION = 60 * 60
+
+# transcribe while the audio is still being fetched, see services.transcribe.transcribe_stream
+STREAM_TRANSCRIPTION = os.getenv("STREAM_TRANSCRIPTION", "false").lower() == "true"
+
+# summarize and categorize in one LLM call, see services.summarize.summarize_and_categorize
+COMBINED_SUMMARY = os.getenv("COMBINED_SUMMARY", "true").lower() == "true"
+
+# admission control, see api.ratelimit
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "database")
+# token buckets as (burst size, seconds to refill a full bucket)
+RATE_LIMITS = {
+    "process": {"user": (5, 5 * 60), "global": (60, 60)},
+    "summarize": {"user": (5, 5 * 60), "global": (30, 60)},
+}
+MAX_INFLIGHT_JOBS = int(os.getenv("MAX_INFLIGHT_JOBS", "200"))
+MAX_INFLIGHT_JOBS_PER_USER = int(os.getenv("MAX_INFLIGHT_JOBS_PER_USER", "20"))
+SUMMARIZE_MAX_CONCURRENCY = int(os.getenv("SUMMARIZE_MAX_CONCURRENCY", "8"))
+# Retry-After sent when a concurrency cap is hit, there is no refill rate to go by
+CONCURRENCY_RETRY_AFTER_SECS = 30
+
+# segmentation of audio for parallel transcription, see services.segment
+TRANSCRIBE_PARALLELISM = int(os.getenv("TRANSCRIBE_PARALLELISM", "10"))
+# target wall time per segment, overrides the parallelism when set
+TRANSCRIBE_SLA_SECS = float(os.getenv("TRANSCRIBE_SLA_SECS", "0")) or None
+# seconds of audio transcribed per second by one Whisper container
+TRANSCRIBE_REALTIME_FACTOR = 60.0
+SEGMENT_OVERHEAD_SECS = 10.0
+
+# speech recognition engine, see services.asr: "hf" on GPU, "ct2" on CPU, or
+# "auto" to send videos up to CPU_ASR_MAX_DURATION seconds to CPU workers
+ASR_BACKEND = os.getenv("ASR_BACKEND", "hf")
+CPU_ASR_MODEL = os.getenv("CPU_ASR_MODEL", "small")
+CPU_ASR_MAX_DURATION = 10 * 60
+# concurrent segments per GPU Whisper container, batched together
+WHISPER_CONCURRENT_INPUTS = int(os.getenv("WHISPER_CONCURRENT_INPUTS", "4"))
+
+# drop non-speech audio before it is sent to Whisper, see services.transcribe.speech_regions
+VAD_FILTER = os.getenv("VAD_FILTER", "true").lower() == "true"
+# a frame is speech at this many dB over the recording's noise floor, with its
+# loudness varying by at least VAD_MODULATION_DB within a second like syllables do
+VAD_MARGIN_DB = 15.0
+VAD_MODULATION_DB = 3.0
+# only non-speech at least this long is dropped, speech is padded on both sides
+VAD_MIN_GAP_SECS = 2.0
+VAD_PAD_SECS = 0.3
+
+# transcripts whose summary prompt is over SUMMARY_SINGLE_PASS_TOKENS are split
+# into pieces of about SUMMARY_PIECE_TOKENS and map-reduced, see services.summarize
+SUMMARY_SINGLE_PASS_TOKENS = int(os.getenv("SUMMARY_SINGLE_PASS_TOKENS", "60000"))
+SUMMARY_PIECE_TOKENS = 12000
+# rounds of reducing notes that are themselves over budget, after the map step
+SUMMARY_MAX_REDUCE_ROUNDS = 2
+# markdown of stored summaries, memoized per API container, see
+# services.summarize.render_summary
+SUMMARY_RENDER_CACHE_SIZE = 1024
+
+# the OpenAI client shared by each summarize container, see services.summarize.get_client,
+# OPENAI_BASE_URL points it at another OpenAI-compatible server
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+OPENAI_MAX_RETRIES = 2
+# concurrent summaries per container, they mostly wait on the API
+SUMMARIZE_CONCURRENT_INPUTS = int(os.getenv("SUMMARIZE_CONCURRENT_INPUTS", "16"))
+
+# estimated costs recorded by services.metrics, in USD per 1M input and output tokens
+LLM_PRICES = {"gpt-4o": (5.0, 15.0)}
+# and in USD per second of a Whisper container, an A10G or 4 CPU cores
+ASR_COST_PER_SEC = {"hf": 1.10 / 3600, "ct2": 4 * 0.192 / 3600}
@@ -9,6 +9,7 @@ async def add_favorite(session, user_id: str, video_id: str):
     from sqlalchemy.exc import SQLAlchemyError
     from sqlalchemy.future import select
 
+    from yt_university.crud.feed import update_user_embedding
     from yt_university.models import favorite
 
     try:
@@ -26,6 +27,7 @@ async def add_favorite(session, user_id: str, video_id: str):
         await session.execute(
             favorite.insert().values(user_id=user_id, video_id=video_id)
         )
+        await update_user_embedding(session, user_id, [video_id], sign=1)
         await session.commit()
         return {"status": "success", "message": "Favorite added successfully"}
     except HTTPException as e:
@@ -41,6 +43,7 @@ async def add_favorite(session, user_id: str, video_id: str):
 async def remove_favorite(session, user_id: str, video_id: str):
     from sqlalchemy.future import select
 
+    from yt_university.crud.feed import update_user_embedding
     from yt_university.models import favorite
 
     try:
@@ -58,6 +61,7 @@ async def remove_favorite(session, user_id: str, video_id: str):
                 favorite.c.user_id == user_id, favorite.c.video_id == video_id
             )
         )
+        await update_user_embedding(session, user_id, [video_id], sign=-1)
         await session.commit()
     except HTTPException as e:
         raise e
@@ -0,0 +1,241 @@
+import logging
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+def _combine(total, vector, sign=1):
+    if total is None:
+        return [sign * value for value in vector]
+    return [a + sign * b for a, b in zip(total, vector)]
+
+
+def _diversify(query, candidates, k, diversity):
+    """
+    Maximal marginal relevance: greedily pick the candidate most similar to the
+    query while penalizing similarity to what has already been picked.
+    """
+    import numpy as np
+
+    if not candidates:
+        return []
+
+    ids = list(candidates)
+    vectors = np.array([candidates[id] for id in ids], dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    query = np.asarray(query, dtype=np.float64)
+    query_norm = np.linalg.norm(query)
+    relevance = vectors @ (query / query_norm if query_norm else query)
+
+    # of each candidate, its highest similarity to a picked one
+    redundancy = np.zeros(len(ids))
+    remaining = np.ones(len(ids), dtype=bool)
+    selected = []
+    for _ in range(min(k, len(ids))):
+        scores = (1 - diversity) * relevance - diversity * redundancy
+        best = int(np.argmax(np.where(remaining, scores, -np.inf)))
+        selected.append(best)
+        remaining[best] = False
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+
+    return [(ids[i], float(relevance[i])) for i in selected]
+
+
+def _seen_video_ids(user_id: str):
+    from sqlalchemy import union_all
+    from sqlalchemy.future import select
+
+    from yt_university.models import Playlist, favorite, playlist_video
+
+    return union_all(
+        select(favorite.c.video_id.label("video_id")).where(
+            favorite.c.user_id == user_id
+        ),
+        select(playlist_video.c.video_id.label("video_id"))
+        .join(Playlist, Playlist.id == playlist_video.c.playlist_id)
+        .where(Playlist.user_id == user_id),
+    )
+
+
+async def rebuild_user_embedding(session, user):
+    """
+    Recompute the cached embedding sum from every favorite and playlist video.
+    Only needed when the cache is cold, afterwards it is maintained incrementally.
+    Writing a video's embedding makes the cache of its users cold, see the
+    video_embedding_written trigger.
+    """
+    from sqlalchemy.future import select
+
+    from yt_university.models import Video
+
+    seen = _seen_video_ids(user.id).subquery()
+    result = await session.execute(
+        select(Video.id, Video.embedding)
+        .join(seen, seen.c.video_id == Video.id)
+        .where(Video.embedding.isnot(None))
+    )
+
+    total, video_ids = None, []
+    for id, embedding in result:
+        total = _combine(total, embedding)
+        video_ids.append(id)
+
+    user.embedding_sum = total
+    user.embedding_count = len(video_ids)
+    user.embedding_video_ids = video_ids
+    return user
+
+
+async def update_user_embedding(session, user_id: str, video_ids: list, sign: int):
+    """
+    Add (sign=1) or subtract (sign=-1) video embeddings from the user's cached
+    embedding sum. Does not commit, so it shares the caller's transaction.
+
+    Only videos recorded in embedding_video_ids are subtracted, so a video
+    that got its embedding after it was added leaves the sum untouched.
+    """
+    from sqlalchemy.future import select
+    from sqlalchemy.orm import undefer
+
+    from yt_university.models import User, Video
+
+    result = await session.execute(
+        select(User)
+        .options(undefer(User.embedding_sum), undefer(User.embedding_video_ids))
+        .where(User.id == user_id)
+        .with_for_update()
+    )
+    user = result.scalars().first()
+
+    # cold cache, the next feed request rebuilds it from scratch
+    if not user or user.embedding_count is None:
+        return
+
+    result = await session.execute(
+        select(Video.id, Video.embedding).where(Video.id.in_(video_ids))
+    )
+    embeddings = dict(result.all())
+
+    total, summed = user.embedding_sum, list(user.embedding_video_ids or [])
+    for id in video_ids:
+        embedding = embeddings.get(id)
+        if sign < 0 and id not in summed:
+            # it had no embedding when it was added
+            continue
+        if embedding is None:
+            if sign < 0:
+                # its embedding is gone, there is nothing to subtract
+                user.embedding_count = None
+                user.embedding_sum = None
+                user.embedding_video_ids = None
+                return
+            continue
+        if total is not None and len(total) != len(embedding):
+            # embedding model changed underneath us, start over
+            user.embedding_count = None
+            user.embedding_sum = None
+            user.embedding_video_ids = None
+            return
+        total = _combine(total, embedding, sign)
+        if sign > 0:
+            summed.append(id)
+        else:
+            summed.remove(id)
+
+    if not summed:
+        total = None
+
+    user.embedding_sum = total
+    user.embedding_count = len(summed)
+    user.embedding_video_ids = summed
+
+
+async def invalidate_user_embedding(session, user_id: str):
+    from sqlalchemy import update
+
+    from yt_university.models import User
+
+    await session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(embedding_sum=None, embedding_count=None, embedding_video_ids=None)
+    )
+
+
+async def get_user_feed(
+    session, user_id: str, limit: int = 10, diversity: float = 0.3, pool_size=200
+):
+    from pgvector.sqlalchemy import Vector
+    from sqlalchemy import cast, func
+    from sqlalchemy.exc import SQLAlchemyError
+    from sqlalchemy.future import select
+    from sqlalchemy.orm import undefer
+
+    from yt_university.models import User, Video
+
+    try:
+        result = await session.execute(
+            select(User).options(undefer(User.embedding_sum)).where(User.id == user_id)
+        )
+        user = result.scalars().first()
+
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        cold = user.embedding_count is None
+        if cold:
+            await rebuild_user_embedding(session, user)
+        # read before the commit expires them
+        embedding_count, query = user.embedding_count, user.embedding_sum
+        if cold:
+            await session.commit()
+
+        seen = _seen_video_ids(user_id)
+
+        if not embedding_count:
+            # nothing to personalize on yet, fall back to the most favorited videos
+            result = await session.execute(
+                select(Video)
+                .where(Video.id.notin_(seen))
+                .order_by(Video.favorite_count.desc())
+                .limit(limit)
+            )
+            return [
+                {**video.__dict__, "score": None} for video in result.scalars().all()
+            ]
+
+        # only the pool closest to the query leaves the database
+        distance = cast(Video.embedding, Vector).cosine_distance(query)
+        result = await session.execute(
+            select(Video.id, Video.embedding)
+            .where(
+                Video.embedding.isnot(None),
+                func.cardinality(Video.embedding) == len(query),
+                Video.id.notin_(seen),
+            )
+            .order_by(distance)
+            .limit(pool_size)
+        )
+        ranked = result.all()
+
+        picks = _diversify(
+            query, {id: embedding for id, embedding in ranked}, limit, diversity
+        )
+
+        result = await session.execute(
+            select(Video).where(Video.id.in_([id for id, _ in picks]))
+        )
+        videos = {video.id: video for video in result.scalars().all()}
+
+        return [
+            {**videos[id].__dict__, "score": score}
+            for id, score in picks
+            if id in videos
+        ]
+    except HTTPException as e:
+        raise e
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to build feed for user {user_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to build user feed")
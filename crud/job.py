@@ -0,0 +1,121 @@
+import logging
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+async def claim_jobs(session, jobs_data: list[dict]):
+    """
+    Insert queued jobs, skipping every video that already has an in-flight job.
+    The partial unique index makes the check and the insert one atomic step, so
+    concurrent requests can never both claim the same video.
+
+    Returns the jobs that were actually inserted.
+    """
+    from sqlalchemy import text
+    from sqlalchemy.dialects.postgresql import insert
+    from sqlalchemy.exc import SQLAlchemyError
+
+    from yt_university.models.job import INFLIGHT_PREDICATE, Job
+
+    if not jobs_data:
+        return []
+
+    try:
+        stmt = (
+            insert(Job)
+            .values([{**job_data, "status": "queued"} for job_data in jobs_data])
+            .on_conflict_do_nothing(
+                index_elements=[Job.video_id],
+                # must match the index predicate literally for Postgres to infer it
+                index_where=text(INFLIGHT_PREDICATE),
+            )
+            .returning(Job)
+        )
+        result = await session.execute(stmt)
+        claimed = result.scalars().all()
+        await session.commit()
+        return claimed
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to claim jobs: {e}")
+        await session.rollback()
+        raise HTTPException(status_code=500, detail="Failed to queue job")
+
+
+async def claim_job(session, job_data: dict):
+    claimed = await claim_jobs(session, [job_data])
+    return claimed[0] if claimed else None
+
+
+async def get_job(session, job_id: str):
+    from sqlalchemy.future import select
+
+    from yt_university.models import Job
+
+    result = await session.execute(select(Job).where(Job.id == job_id))
+    return result.scalars().first()
+
+
+async def get_inflight_job(session, video_id: str):
+    from sqlalchemy.future import select
+
+    from yt_university.models import INFLIGHT_STATUSES, Job
+
+    result = await session.execute(
+        select(Job).where(Job.video_id == video_id, Job.status.in_(INFLIGHT_STATUSES))
+    )
+    return result.scalars().first()
+
+
+async def count_inflight_jobs(session, user_id: str | None = None) -> int:
+    from sqlalchemy import func
+    from sqlalchemy.future import select
+
+    from yt_university.models import INFLIGHT_STATUSES, Job
+
+    query = select(func.count(Job.id)).where(Job.status.in_(INFLIGHT_STATUSES))
+    if user_id:
+        query = query.where(Job.user_id == user_id)
+
+    result = await session.execute(query)
+    return result.scalar()
+
+
+async def get_jobs(session, status=None, job_ids=None):
+    from sqlalchemy.future import select
+
+    from yt_university.models import Job
+
+    query = select(Job).order_by(Job.created_at)
+    if status:
+        query = query.where(Job.status.in_(status))
+    if job_ids is not None:
+        query = query.where(Job.id.in_(job_ids))
+
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def update_job(session, job_id: str, update_data: dict, from_status=None):
+    """
+    Update a job, optionally only if it is still in one of from_status.
+    Returns whether a row was updated.
+    """
+    from sqlalchemy import update
+    from sqlalchemy.exc import SQLAlchemyError
+
+    from yt_university.models import Job
+
+    try:
+        stmt = update(Job).where(Job.id == job_id).values(**update_data)
+        if from_status:
+            stmt = stmt.where(Job.status.in_(from_status))
+
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount > 0
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to update job {job_id}: {e}")
+        await session.rollback()
+        raise HTTPException(status_code=500, detail="Failed to update job")
@@ -0,0 +1,88 @@
+import logging
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+async def add_video_metrics(session, video_id: str, metrics: list[dict]):
+    from sqlalchemy.exc import SQLAlchemyError
+
+    from yt_university.models import VideoMetric
+
+    try:
+        session.add_all(
+            [VideoMetric(video_id=video_id, **metric) for metric in metrics]
+        )
+        await session.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to store metrics of {video_id}: {e}")
+        await session.rollback()
+        raise HTTPException(status_code=500, detail="Failed to store metrics")
+
+
+async def get_video_metrics(session, video_id: str):
+    from sqlalchemy.future import select
+
+    from yt_university.models import VideoMetric
+
+    result = await session.execute(
+        select(VideoMetric)
+        .where(VideoMetric.video_id == video_id)
+        .order_by(VideoMetric.created_at)
+    )
+    return result.scalars().all()
+
+
+async def get_stage_totals(session, fields: tuple) -> dict:
+    """
+    Runs and the sums of fields of every stage recorded, summed by the
+    database so concurrent writers are all counted.
+    """
+    from sqlalchemy import func, select
+
+    from yt_university.models import VideoMetric
+
+    result = await session.execute(
+        select(
+            VideoMetric.stage,
+            func.count(VideoMetric.id),
+            *(
+                func.coalesce(func.sum(getattr(VideoMetric, field)), 0)
+                for field in fields
+            ),
+        ).group_by(VideoMetric.stage)
+    )
+    return {
+        stage: {"runs": runs, **dict(zip(fields, sums))}
+        for stage, runs, *sums in result.all()
+    }
+
+
+async def increment_counter(session, key: str):
+    from sqlalchemy.dialects.postgresql import insert
+
+    from yt_university.models import CacheCounter
+
+    statement = insert(CacheCounter).values(key=key, count=1)
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[CacheCounter.key],
+            set_={"count": CacheCounter.count + 1},
+        )
+    )
+    await session.commit()
+
+
+async def get_counters(session, keys: list[str]) -> dict:
+    """
+    Counts of keys, 0 for the ones never incremented.
+    """
+    from sqlalchemy.future import select
+
+    from yt_university.models import CacheCounter
+
+    result = await session.execute(
+        select(CacheCounter.key, CacheCounter.count).where(CacheCounter.key.in_(keys))
+    )
+    return {key: 0 for key in keys} | dict(result.all())
@@ -10,6 +10,7 @@ async def add_playlist(session, playlist_data):
     from sqlalchemy.exc import SQLAlchemyError
     from sqlalchemy.future import select
 
+    from yt_university.crud.feed import update_user_embedding
     from yt_university.models import Playlist, User, Video
 
     try:
@@ -28,6 +29,10 @@ async def add_playlist(session, playlist_data):
             playlist.videos.extend(videos.scalars().all())
 
         session.add(playlist)
+        if playlist.user and playlist.videos:
+            await update_user_embedding(
+                session, user_id, [video.id for video in playlist.videos], sign=1
+            )
         await session.commit()
         await session.refresh(playlist)
         return playlist
@@ -74,6 +79,7 @@ async def add_videos_to_playlist(session, playlist_id: str, video_ids: list):
     from sqlalchemy.future import select
     from sqlalchemy.orm import joinedload
 
+    from yt_university.crud.feed import update_user_embedding
     from yt_university.models import Playlist, Video
 
     try:
@@ -94,10 +100,15 @@ async def add_videos_to_playlist(session, playlist_id: str, video_ids: list):
 
         if not videos:
             raise HTTPException(status_code=404, detail="No videos found")
+
+        added = []
         for video in videos:
             if video not in playlist.videos:
                 playlist.videos.append(video)
+                added.append(video.id)
 
+        if added:
+            await update_user_embedding(session, playlist.user_id, added, sign=1)
         await session.commit()
         return playlist
 
@@ -116,6 +127,7 @@ async def remove_videos_from_playlist(session, playlist_id: str, video_ids: list
     from sqlalchemy.future import select
     from sqlalchemy.orm import joinedload
 
+    from yt_university.crud.feed import update_user_embedding
     from yt_university.models import Playlist, Video
 
     try:
@@ -137,10 +149,14 @@ async def remove_videos_from_playlist(session, playlist_id: str, video_ids: list
         if not videos:
             raise HTTPException(status_code=404, detail="No videos found")
 
+        removed = []
         for video in videos:
             if video in playlist.videos:
                 playlist.videos.remove(video)
+                removed.append(video.id)
 
+        if removed:
+            await update_user_embedding(session, playlist.user_id, removed, sign=-1)
         await session.commit()
 
     except HTTPException as e:
@@ -157,6 +173,7 @@ async def remove_videos_from_playlist(session, playlist_id: str, video_ids: list
 async def delete_playlist(session, playlist_id: str):
     from sqlalchemy.future import select
 
+    from yt_university.crud.feed import invalidate_user_embedding
     from yt_university.models import Playlist
 
     try:
@@ -169,6 +186,7 @@ async def delete_playlist(session, playlist_id: str):
             raise HTTPException(status_code=404, detail="Playlist not found")
 
         await session.delete(playlist)
+        await invalidate_user_embedding(session, playlist.user_id)
         await session.commit()
 
     except HTTPException as e:
@@ -0,0 +1,67 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def get_bucket_for_update(session, key: str, capacity: float, now: float):
+    """
+    Lock the token bucket of key, creating it full if it does not exist yet.
+    The lock is held until the caller commits.
+    """
+    from sqlalchemy.dialects.postgresql import insert
+    from sqlalchemy.future import select
+
+    from yt_university.models import RateLimitBucket
+
+    await session.execute(
+        insert(RateLimitBucket)
+        .values(key=key, tokens=capacity, refilled_at=now)
+        .on_conflict_do_nothing(index_elements=[RateLimitBucket.key])
+    )
+    result = await session.execute(
+        select(RateLimitBucket).where(RateLimitBucket.key == key).with_for_update()
+    )
+    return result.scalars().first()
+
+
+async def acquire_lease(session, key: str, limit: int, ttl: float, now: float):
+    """
+    Take one of limit concurrent leases on key. Returns the lease id, or None
+    when all of them are taken.
+    """
+    from uuid import uuid4
+
+    from sqlalchemy import delete, func, select
+    from sqlalchemy.dialects.postgresql import insert
+
+    from yt_university.models import RateLimitLease
+
+    # serializes the count and the insert across web containers
+    await session.execute(select(func.pg_advisory_xact_lock(func.hashtext(key))))
+    await session.execute(
+        delete(RateLimitLease).where(
+            RateLimitLease.key == key, RateLimitLease.expires_at < now
+        )
+    )
+    result = await session.execute(
+        select(func.count(RateLimitLease.id)).where(RateLimitLease.key == key)
+    )
+    if result.scalar() >= limit:
+        await session.commit()
+        return None
+
+    lease_id = uuid4().hex
+    await session.execute(
+        insert(RateLimitLease).values(id=lease_id, key=key, expires_at=now + ttl)
+    )
+    await session.commit()
+    return lease_id
+
+
+async def release_lease(session, lease_id: str):
+    from sqlalchemy import delete
+
+    from yt_university.models import RateLimitLease
+
+    await session.execute(delete(RateLimitLease).where(RateLimitLease.id == lease_id))
+    await session.commit()
@@ -0,0 +1,101 @@
+import logging
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+async def add_transcript_segment(session, video_id: str, segment: dict):
+    from sqlalchemy.dialects.postgresql import insert
+    from sqlalchemy.exc import SQLAlchemyError
+
+    from yt_university.models import TranscriptSegment
+
+    values = {
+        "video_id": video_id,
+        "start": segment["start"],
+        "end": segment["end"],
+        "chunks": segment["chunks"],
+    }
+    try:
+        await session.execute(
+            insert(TranscriptSegment)
+            .values(**values)
+            .on_conflict_do_update(
+                index_elements=[TranscriptSegment.video_id, TranscriptSegment.start],
+                set_={"end": values["end"], "chunks": values["chunks"]},
+            )
+        )
+        await session.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to store transcript segment of {video_id}: {e}")
+        await session.rollback()
+        raise HTTPException(status_code=500, detail="Failed to store transcript")
+
+
+async def get_transcript_segments(session, video_id: str):
+    """
+    Stored segments in order. Where a changed plan left segments overlapping,
+    the earliest one wins.
+    """
+    from sqlalchemy.future import select
+
+    from yt_university.models import TranscriptSegment
+
+    result = await session.execute(
+        select(TranscriptSegment)
+        .where(TranscriptSegment.video_id == video_id)
+        .order_by(TranscriptSegment.start)
+    )
+
+    segments = []
+    for segment in result.scalars().all():
+        if segments and segment.start < segments[-1].end:
+            continue
+        segments.append(segment)
+    return segments
+
+
+def transcript_gaps(
+    segments, duration: float | None, duration_error: float = 0.0
+) -> list[tuple[float, float]]:
+    """
+    Stretches of the video not covered by any stored segment. Segment bounds
+    are rounded to the millisecond, see segment_bounds, so shorter stretches
+    don't count. Nor does a stretch at the end within duration_error, for a
+    duration rounded to the second by the metadata.
+    """
+    gaps = []
+    covered = 0.0
+    for segment in segments:
+        if segment.start - covered > 0.001:
+            gaps.append((covered, segment.start))
+        covered = max(covered, segment.end)
+    if duration and duration - covered > max(duration_error, 0.001):
+        gaps.append((covered, float(duration)))
+    return gaps
+
+
+async def get_decoded_duration(session, video_id: str) -> float | None:
+    """
+    Length of a video's decoded audio, as the segmentation of its last
+    completed transcribe stage reported it.
+    """
+    from sqlalchemy.future import select
+
+    from yt_university.models import VideoMetric
+
+    result = await session.execute(
+        select(VideoMetric.audio_secs)
+        .where(VideoMetric.video_id == video_id, VideoMetric.stage == "segmentation")
+        .order_by(VideoMetric.created_at.desc())
+        .limit(1)
+    )
+    return result.scalar()
+
+
+def assemble_transcription(segments) -> dict:
+    return {
+        "chunks": [chunk for segment in segments for chunk in segment.chunks],
+        "language": "en",
+    }
@@ -20,3 +20,18 @@ def sanitize_youtube_url(url):
     # Construct a clean YouTube URL with only the video ID
     safe_url = f"https://www.youtube.com/watch?v={video_id[0]}"
     return safe_url
+
+
+def get_youtube_video_id(url):
+    parsed_url = urlparse(url)
+
+    if "youtu.be" in parsed_url.netloc:
+        # Shortened format, the ID is the path without the leading '/'
+        video_id = parsed_url.path[1:]
+    else:
+        video_id = parse_qs(parsed_url.query).get("v", [None])[0]
+
+    if not video_id:
+        raise ValueError("Invalid YouTube URL provided.")
+
+    return video_id
@@ -1,3 +1,7 @@
+from .job import INFLIGHT_STATUSES, Job
+from .metrics import CacheCounter, VideoMetric
 from .playlist import Playlist, playlist_video
+from .rate_limit import RateLimitBucket, RateLimitLease
+from .transcript import TranscriptSegment
 from .user import User, favorite
 from .video import Video
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, Index, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import AlchemyBase
+
+# statuses of jobs that hold the claim on their video
+INFLIGHT_STATUSES = ("queued", "running")
+INFLIGHT_PREDICATE = "status IN ('queued', 'running')"
+
+
+class Job(AlchemyBase):
+    __tablename__ = "job"
+    __table_args__ = (
+        # at most one in-flight job per video, the target of claim_job's ON CONFLICT
+        Index(
+            "ix_job_inflight_video_id",
+            "video_id",
+            unique=True,
+            postgresql_where=text(INFLIGHT_PREDICATE),
+        ),
+    )
+
+    id: Mapped[str] = mapped_column(primary_key=True)
+    video_id: Mapped[str] = mapped_column(nullable=False)
+    url: Mapped[str] = mapped_column(nullable=False)
+    user_id: Mapped[str] = mapped_column(index=True, nullable=True)
+    status: Mapped[str] = mapped_column(index=True, nullable=False)
+    stage: Mapped[str] = mapped_column(nullable=True)
+    call_id: Mapped[str] = mapped_column(nullable=True)
+    duration: Mapped[int] = mapped_column(nullable=True)
+    group: Mapped[str] = mapped_column(index=True, nullable=True)
+    max_concurrency: Mapped[int] = mapped_column(nullable=True)
+    error: Mapped[str] = mapped_column(nullable=True)
+    started_at: Mapped[datetime] = mapped_column(type_=DateTime, nullable=True)
+    finished_at: Mapped[datetime] = mapped_column(type_=DateTime, nullable=True)
@@ -0,0 +1,39 @@
+from uuid import UUID, uuid4
+
+from sqlalchemy import JSON
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import AlchemyBase
+
+
+class VideoMetric(AlchemyBase):
+    """
+    Time and cost of one run of a pipeline stage on a video, or of one of its
+    transcribed segments.
+    """
+
+    __tablename__ = "video_metric"
+
+    id: Mapped[UUID] = mapped_column(default=uuid4, primary_key=True)
+    video_id: Mapped[str] = mapped_column(index=True, nullable=False)
+    job_id: Mapped[str] = mapped_column(nullable=True)
+    stage: Mapped[str] = mapped_column(index=True, nullable=False)
+    wall_secs: Mapped[float] = mapped_column(nullable=True)
+    queue_secs: Mapped[float] = mapped_column(nullable=True)
+    audio_secs: Mapped[float] = mapped_column(nullable=True)
+    input_tokens: Mapped[int] = mapped_column(nullable=True)
+    output_tokens: Mapped[int] = mapped_column(nullable=True)
+    cost_usd: Mapped[float] = mapped_column(nullable=True)
+    details: Mapped[JSON] = mapped_column(type_=JSON, nullable=True)
+
+
+class CacheCounter(AlchemyBase):
+    """
+    Count of one kind of cache access, incremented in the database so
+    concurrent containers don't lose updates.
+    """
+
+    __tablename__ = "cache_counter"
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(server_default="0", nullable=False)
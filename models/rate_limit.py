@@ -0,0 +1,21 @@
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import AlchemyBase
+
+
+class RateLimitBucket(AlchemyBase):
+    __tablename__ = "rate_limit_bucket"
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    tokens: Mapped[float] = mapped_column(nullable=False)
+    # epoch seconds, compared against time.time() of the web containers
+    refilled_at: Mapped[float] = mapped_column(nullable=False)
+
+
+class RateLimitLease(AlchemyBase):
+    __tablename__ = "rate_limit_lease"
+
+    id: Mapped[str] = mapped_column(primary_key=True)
+    key: Mapped[str] = mapped_column(index=True, nullable=False)
+    # leases of crashed requests stop counting once expired
+    expires_at: Mapped[float] = mapped_column(nullable=False)
@@ -0,0 +1,18 @@
+from sqlalchemy import JSON
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import AlchemyBase
+
+
+class TranscriptSegment(AlchemyBase):
+    """
+    One transcribed segment of a video, stored as soon as it completes so a
+    partial transcript can be served and a restart skips it.
+    """
+
+    __tablename__ = "transcript_segment"
+
+    video_id: Mapped[str] = mapped_column(primary_key=True)
+    start: Mapped[float] = mapped_column(primary_key=True)
+    end: Mapped[float] = mapped_column(nullable=False)
+    chunks: Mapped[JSON] = mapped_column(type_=JSON, nullable=False)
@@ -1,7 +1,7 @@
 from uuid import uuid4
 
-from sqlalchemy import JSON, Column, DateTime, ForeignKey, Table
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import ARRAY, JSON, Column, DateTime, Float, ForeignKey, String, Table
+from sqlalchemy.orm import Mapped, deferred, mapped_column, relationship
 from sqlalchemy.sql import func
 
 from .base import AlchemyBase
@@ -25,6 +25,17 @@ class User(AlchemyBase):
     primary_email_address_id: Mapped[str] = mapped_column(nullable=True)
     email_addresses: Mapped[JSON] = mapped_column(type_=JSON, nullable=True)
 
+    # running sum of the embeddings of the user's favorites and playlist videos,
+    # a null count means the cache has not been built yet
+    embedding_sum: Mapped[ARRAY(Float)] = deferred(
+        mapped_column(type_=ARRAY(Float, dimensions=1), nullable=True)
+    )
+    embedding_count: Mapped[int] = mapped_column(nullable=True)
+    # the videos whose embeddings are in the sum, once per favorite or playlist
+    embedding_video_ids: Mapped[ARRAY(String)] = deferred(
+        mapped_column(type_=ARRAY(String, dimensions=1), nullable=True)
+    )
+
     videos = relationship("Video", back_populates="uploaded_by")
     favorites = relationship("Video", secondary=favorite, back_populates="favorited_by")
     playlists = relationship("Playlist", back_populates="user")
@@ -31,7 +31,13 @@ class Video(AlchemyBase):
     )
     transcription: Mapped[JSON] = deferred(mapped_column(type_=JSON, nullable=True))
     summary: Mapped[str] = deferred(mapped_column(nullable=True))
+    # the summary as the model returned it, summary is its markdown
+    summary_json: Mapped[JSON] = deferred(mapped_column(type_=JSON, nullable=True))
+    # loaded with every video, for list views
+    tldr: Mapped[str] = mapped_column(nullable=True)
     related_content: Mapped[JSON] = deferred(mapped_column(type_=JSON, nullable=True))
+    # completed processing stages and their outputs, see services.process.STAGES
+    checkpoints: Mapped[JSON] = deferred(mapped_column(type_=JSON, nullable=True))
 
     user_id: Mapped[str] = mapped_column(ForeignKey("user.id"), nullable=True)
     uploaded_by = relationship("User", back_populates="videos", uselist=False)
@@ -0,0 +1,332 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# Whisper's receptive field, longer audio has to be windowed
+WINDOW_SECS = 30.0
+
+
+class ASRBackend:
+    """
+    Speech recognition engine behind Whisper.transcribe_segment.
+
+    transcribe takes 16 kHz mono float32 audio and returns the Hugging Face
+    pipeline's output format, {"text": ..., "chunks": [{"timestamp": (start,
+    end), "text": ...}]}, with timestamps relative to the audio.
+    """
+
+    name: str
+    model_id: str
+    generate_kwargs: dict
+
+    def cache_key(self) -> str:
+        """
+        Identifies the outputs of this engine, model and generation settings.
+        """
+        import hashlib
+        import json
+
+        config = [self.name, self.model_id, self.generate_kwargs]
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    def load(self):
+        raise NotImplementedError
+
+    def transcribe(self, audio) -> dict:
+        raise NotImplementedError
+
+    def transcribe_batch(self, audios: list) -> list[dict]:
+        return [self.transcribe(audio) for audio in audios]
+
+    def release(self):
+        """Free memory held between segments."""
+
+
+class HFWhisperBackend(ASRBackend):
+    """
+    transformers pipeline, in fp16 with flash attention when a GPU is present.
+    """
+
+    name = "hf"
+
+    def __init__(self, model_id: str, model_dir: str):
+        self.model_id = model_id
+        self.model_dir = model_dir
+        self.generate_kwargs = {"language": "<|en|>", "task": "transcribe"}
+
+    def load(self):
+        import torch
+        from transformers import (
+            AutoModelForSpeechSeq2Seq,
+            AutoProcessor,
+            pipeline,
+            utils,
+        )
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        device_int = 0 if device == "cuda" else -1
+        logger.info(f"Running on {device}")
+        torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+
+        model = AutoModelForSpeechSeq2Seq.from_pretrained(
+            self.model_dir,
+            torch_dtype=torch_dtype,
+            use_safetensors=True,
+            attn_implementation="flash_attention_2"
+            if utils.is_flash_attn_2_available() == "cuda"
+            else "sdpa",
+        ).to(device)
+
+        processor = AutoProcessor.from_pretrained(self.model_dir)
+
+        self.pipe = pipeline(
+            "automatic-speech-recognition",
+            model=model,
+            tokenizer=processor.tokenizer,
+            feature_extractor=processor.feature_extractor,
+            max_new_tokens=128,
+            torch_dtype=torch_dtype,
+            chunk_length_s=30,
+            batch_size=24,
+            return_timestamps=True,
+            model_kwargs={"attn_implementation": "flash_attention_2"},
+            device=device_int,
+        )
+
+    def transcribe(self, audio) -> dict:
+        return self.pipe(
+            {"raw": audio, "sampling_rate": SAMPLE_RATE},
+            generate_kwargs=self.generate_kwargs,
+        )
+
+    def transcribe_batch(self, audios: list) -> list[dict]:
+        return self.pipe(
+            [{"raw": audio, "sampling_rate": SAMPLE_RATE} for audio in audios],
+            batch_size=len(audios),
+            generate_kwargs=self.generate_kwargs,
+        )
+
+    def release(self):
+        import torch
+
+        with torch.no_grad():
+            torch.cuda.empty_cache()
+
+
+class CTranslate2Backend(ASRBackend):
+    """
+    faster-whisper on CPU with int8 weights, for short videos and machines
+    without a GPU.
+    """
+
+    name = "ct2"
+
+    def __init__(self, model_id: str, model_dir: str, cpu_threads: int = 0):
+        self.model_id = model_id
+        self.model_dir = model_dir
+        self.cpu_threads = cpu_threads
+        self.generate_kwargs = {"language": "en", "task": "transcribe", "beam_size": 5}
+
+    def load(self):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(
+            self.model_dir,
+            device="cpu",
+            compute_type="int8",
+            cpu_threads=self.cpu_threads,
+        )
+
+    def transcribe(self, audio) -> dict:
+        segments, _ = self.model.transcribe(audio, **self.generate_kwargs)
+        chunks = [
+            {"timestamp": (segment.start, segment.end), "text": segment.text}
+            for segment in segments
+        ]
+        return {"text": "".join(chunk["text"] for chunk in chunks), "chunks": chunks}
+
+
+def window_bounds(audio, window_secs: float = WINDOW_SECS, search_secs: float = 5.0):
+    """
+    Split audio into windows of at most window_secs, ending each one at the
+    quietest 100 ms within its last search_secs so words are rarely cut.
+    """
+    import numpy as np
+
+    window = int(window_secs * SAMPLE_RATE)
+    search = int(search_secs * SAMPLE_RATE)
+    frame = SAMPLE_RATE // 10
+
+    bounds = []
+    start = 0
+    while len(audio) - start > window:
+        tail = np.abs(audio[start + window - search : start + window])
+        frames = tail[: len(tail) // frame * frame].reshape(-1, frame).max(axis=1)
+        end = start + window - search + int(frames.argmin()) * frame + frame // 2
+        bounds.append((start, end))
+        start = end
+    bounds.append((start, len(audio)))
+    return bounds
+
+
+class DynamicBatcher:
+    """
+    Packs the windows of concurrent transcribe calls, from any video, into
+    batches for a single backend. A batch is run once it is full or its
+    oldest window has waited max_wait seconds.
+
+    Exposes transcribe and release, so it can stand in for its backend.
+    """
+
+    def __init__(self, backend: ASRBackend, batch_size: int = 24, max_wait=0.05):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+
+        self.audio_secs = 0.0
+        self.busy_secs = 0.0
+        self.batches = 0
+        self.windows = 0
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def transcribe(self, audio) -> dict:
+        import numpy as np
+
+        if not len(audio):
+            return {"text": "", "chunks": []}
+
+        futures = []
+        for start, end in window_bounds(audio):
+            future = Future()
+            # a copy, the worker thread holds on to its last batch and a view
+            # of a memory-mapped PCM file would keep it open past a reload
+            self.requests.put((np.array(audio[start:end]), future))
+            futures.append((start / SAMPLE_RATE, future))
+
+        text, chunks = [], []
+        model_secs = 0.0
+        for offset, future in futures:
+            result, secs = future.result()
+            text.append(result["text"])
+            model_secs += secs
+            for chunk in result["chunks"]:
+                begin, end = chunk["timestamp"]
+                chunks.append(
+                    {
+                        **chunk,
+                        "timestamp": (
+                            begin + offset if begin is not None else None,
+                            end + offset if end is not None else None,
+                        ),
+                    }
+                )
+        return {"text": "".join(text), "chunks": chunks, "model_secs": model_secs}
+
+    def release(self):
+        self.backend.release()
+
+    def next_batch(self) -> list:
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            audios = [audio for audio, _ in batch]
+
+            t0 = time.monotonic()
+            try:
+                results = self.backend.transcribe_batch(audios)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            busy_secs = time.monotonic() - t0
+            self.busy_secs += busy_secs
+
+            samples = sum(len(audio) for audio in audios)
+            self.audio_secs += samples / SAMPLE_RATE
+            self.batches += 1
+            self.windows += len(batch)
+            # each window is charged its share of the batch, by length
+            for (audio, future), result in zip(batch, results):
+                future.set_result((result, busy_secs * len(audio) / samples))
+
+    def metrics(self) -> dict:
+        return {
+            "audio_secs": self.audio_secs,
+            "busy_secs": self.busy_secs,
+            # audio seconds transcribed per second spent in the model
+            "throughput": self.audio_secs / self.busy_secs if self.busy_secs else None,
+            "batches": self.batches,
+            "mean_batch_size": self.windows / self.batches if self.batches else None,
+        }
+
+
+def benchmark_batching(
+    backend: ASRBackend,
+    segments: int = 8,
+    segment_secs: float = 120.0,
+    concurrency: int = 4,
+    batch_size: int = 24,
+) -> dict:
+    """
+    Throughput of a loaded backend on synthetic audio, transcribing segments
+    one after another versus concurrently through a DynamicBatcher.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    t = np.arange(int(segment_secs * SAMPLE_RATE)) / SAMPLE_RATE
+    # tone bursts separated by pauses, so windows end on quiet frames
+    envelope = (np.sin(2 * np.pi * t / 4) > 0).astype(np.float32)
+    audios = [
+        (0.3 * envelope * np.sin(2 * np.pi * rng.uniform(150, 400) * t)).astype(
+            np.float32
+        )
+        for _ in range(segments)
+    ]
+    audio_secs = segments * segment_secs
+
+    t0 = time.monotonic()
+    for audio in audios:
+        backend.transcribe(audio)
+    sequential_secs = time.monotonic() - t0
+
+    batcher = DynamicBatcher(backend, batch_size=batch_size)
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(batcher.transcribe, audios))
+    batched_secs = time.monotonic() - t0
+
+    return {
+        "model_id": backend.model_id,
+        "audio_secs": audio_secs,
+        "sequential": {
+            "wall_secs": sequential_secs,
+            "throughput": audio_secs / sequential_secs,
+        },
+        "batched": {
+            "wall_secs": batched_secs,
+            "throughput": audio_secs / batched_secs,
+            **batcher.metrics(),
+        },
+    }
@@ -0,0 +1,40 @@
+BATCH_STATUSES = (
+    "queued",
+    "running",
+    "succeeded",
+    "failed",
+    "expired",
+    "cancelled",
+    "skipped",
+)
+
+
+async def batch_progress(session, batch_id: str, batch: dict) -> dict:
+    """
+    Aggregate the job statuses of a batch into counts and overall progress.
+    Videos that were skipped at submission have no job.
+    """
+    from yt_university.crud.job import get_jobs
+
+    job_ids = [job_id for job_id in batch["videos"].values() if job_id]
+    jobs = {job.id: job for job in await get_jobs(session, job_ids=job_ids)}
+
+    statuses = {}
+    for video_id, job_id in batch["videos"].items():
+        job = jobs.get(job_id)
+        statuses[video_id] = job.status if job else "skipped"
+
+    counts = {status: 0 for status in BATCH_STATUSES}
+    for status in statuses.values():
+        counts[status] += 1
+
+    total = len(statuses)
+    finished = total - counts["queued"] - counts["running"]
+
+    return {
+        "batch_id": batch_id,
+        "total": total,
+        **counts,
+        "progress": finished / total if total else 1.0,
+        "videos": statuses,
+    }
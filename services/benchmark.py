@@ -0,0 +1,334 @@
+import os
+import time
+from contextlib import contextmanager
+
+from yt_university.config import (
+    TRANSCRIBE_PARALLELISM,
+    VAD_FILTER,
+    WHISPER_CONCURRENT_INPUTS,
+)
+from yt_university.services.asr import ASRBackend, CTranslate2Backend, DynamicBatcher
+from yt_university.services.segment import (
+    greedy_segments,
+    plan_segments,
+    simulate_makespan,
+)
+from yt_university.services.transcribe import (
+    DATA_DIR,
+    SAMPLE_RATE,
+    NoiseFloor,
+    cpu_image,
+    energy_silences,
+    speech_regions,
+    transcribe_pcm_segment,
+    vad_regions,
+    volume,
+)
+from yt_university.stub import stub
+
+# Run with
+#   modal run yt_university/services/benchmark.py --duration 1800 --model mock
+# and diff the JSON between commits. Realtime factors are audio seconds per
+# wall second, as TRANSCRIBE_REALTIME_FACTOR, so higher is faster.
+
+# recordings VAD must keep the speech of, as synthetic_pcm arguments: speech
+# after a long music intro with only short pauses, quieter speech, and speech
+# over a music bed
+VAD_RECALL_CASES = {
+    "music_intro": {"intro_secs": 60.0, "pause_secs": (0.2, 0.6)},
+    "quiet_speech": {
+        "intro_secs": 40.0,
+        "pause_secs": (0.2, 0.6),
+        "speech_amplitude": 0.2,
+    },
+    "music_bed": {"intro_secs": 0.0, "pause_secs": (0.2, 0.6), "music_bed": 0.1},
+}
+
+
+class MockBackend(ASRBackend):
+    """
+    Sleeps instead of running a model, a fixed overhead per call plus a time
+    proportional to the audio, so batching still pays off as it would on a GPU.
+    Returns a chunk for every 5 seconds of audio.
+    """
+
+    name = "mock"
+
+    def __init__(self, realtime_factor: float = 60.0, call_overhead: float = 0.05):
+        self.model_id = "mock"
+        self.realtime_factor = realtime_factor
+        self.call_overhead = call_overhead
+        self.generate_kwargs = {}
+
+    def load(self):
+        pass
+
+    def transcribe(self, audio) -> dict:
+        return self.transcribe_batch([audio])[0]
+
+    def transcribe_batch(self, audios: list) -> list[dict]:
+        audio_secs = sum(len(audio) for audio in audios) / SAMPLE_RATE
+        time.sleep(self.call_overhead + audio_secs / self.realtime_factor)
+
+        results = []
+        for audio in audios:
+            secs = len(audio) / SAMPLE_RATE
+            chunks = [
+                {"timestamp": (start, min(start + 5.0, secs)), "text": " lorem"}
+                for start in range(0, int(secs), 5)
+            ]
+            results.append({"text": " lorem" * len(chunks), "chunks": chunks})
+        return results
+
+
+def synthetic_pcm(
+    path: str,
+    duration: float,
+    speech_secs: tuple[float, float] = (3.0, 25.0),
+    pause_secs: tuple[float, float] = (0.2, 2.5),
+    intro_secs: float = 30.0,
+    seed: int = 0,
+    speech_amplitude: float = 0.4,
+    music_bed: float = 0.0,
+    spans: list | None = None,
+) -> float:
+    """
+    Write raw PCM of a steady music bed for intro_secs, then speech-like
+    bursts, harmonics of a wandering pitch under a syllable envelope,
+    alternating with pauses of low noise. Some pauses are long enough to be
+    detected as silences, most are not. With music_bed, the music carries on
+    under the speech at that amplitude.
+
+    Written a burst at a time, so long durations don't need the whole audio
+    in memory. Returns the duration written in seconds, and appends the
+    bounds of each burst to spans when given.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    written = 0
+    total = int(duration * SAMPLE_RATE)
+
+    def write(f, samples, bed: float):
+        t = (written + np.arange(len(samples))) / SAMPLE_RATE
+        chord = sum(np.sin(2 * np.pi * pitch * t) for pitch in (220, 277, 330)) / 3
+        f.write(np.clip(samples + bed * chord, -1, 1).astype(np.float32).tobytes())
+        return written + len(samples)
+
+    with open(path, "wb") as f:
+        n = min(int(intro_secs * SAMPLE_RATE), total)
+        written = write(f, np.zeros(n), 0.2)
+
+        while written < total:
+            n = min(int(rng.uniform(*speech_secs) * SAMPLE_RATE), total - written)
+            t = np.arange(n) / SAMPLE_RATE
+            pitch = rng.uniform(100, 220) * (1 + 0.1 * np.sin(2 * np.pi * 0.5 * t))
+            phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+            voice = sum(np.sin(k * phase) / k for k in range(1, 5))
+            syllables = np.abs(np.sin(2 * np.pi * rng.uniform(3, 5) * t)) ** 1.5
+            burst = speech_amplitude * syllables * voice + 0.02 * rng.standard_normal(n)
+            if spans is not None:
+                spans.append((written / SAMPLE_RATE, (written + n) / SAMPLE_RATE))
+            written = write(f, burst, music_bed)
+
+            n = min(int(rng.uniform(*pause_secs) * SAMPLE_RATE), total - written)
+            written = write(f, 0.005 * rng.standard_normal(n), music_bed)
+
+    return written / SAMPLE_RATE
+
+
+def segment_balance(segments: list[tuple[float, float]]) -> dict:
+    lengths = [end - start for start, end in segments]
+    mean = sum(lengths) / len(lengths) if lengths else 0.0
+    return {
+        "count": len(lengths),
+        "min_secs": min(lengths, default=0.0),
+        "max_secs": max(lengths, default=0.0),
+        "mean_secs": mean,
+        # 1.0 when every segment is the same length
+        "max_over_mean": max(lengths) / mean if mean else None,
+        "simulated": simulate_makespan(segments, TRANSCRIBE_PARALLELISM),
+    }
+
+
+def vad_recall(workdir: str = "/tmp", duration: float = 120.0, seed: int = 0) -> dict:
+    """
+    Share of the speech speech_regions keeps, and of all the audio, on each
+    of VAD_RECALL_CASES taken as a single segment. Recall should stay at 1.0.
+    """
+    results = {}
+    for case, kwargs in VAD_RECALL_CASES.items():
+        pcm_path = os.path.join(workdir, f"vad-{case}-{seed}.pcm")
+        spans = []
+        audio_secs = synthetic_pcm(pcm_path, duration, seed=seed, spans=spans, **kwargs)
+        regions = speech_regions(pcm_path, 0.0, audio_secs)
+        os.remove(pcm_path)
+
+        speech_secs = sum(end - start for start, end in spans)
+        kept_secs = sum(
+            max(min(end, region_end) - max(start, region_start), 0.0)
+            for start, end in spans
+            for region_start, region_end in regions
+        )
+        results[case] = {
+            "recall": kept_secs / speech_secs if speech_secs else None,
+            "kept": sum(end - start for start, end in regions) / audio_secs,
+        }
+    return results
+
+
+def peak_rss_mb() -> float:
+    import resource
+
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark(
+    backend: ASRBackend,
+    duration: float = 600.0,
+    batch_size: int = 24,
+    concurrency: int = WHISPER_CONCURRENT_INPUTS,
+    seed: int = 0,
+    workdir: str = "/tmp",
+) -> dict:
+    """
+    Time each transcription stage on synthetic audio: synthesis, silence
+    detection, segment planning, voice activity detection, model load, and
+    transcribing every planned segment concurrently through a DynamicBatcher
+    of batch_size, as one Whisper container does.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    stages = {}
+
+    @contextmanager
+    def timed(stage: str):
+        t0 = time.monotonic()
+        yield
+        stages[stage] = {
+            "secs": time.monotonic() - t0,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    pcm_path = os.path.join(workdir, f"benchmark-{seed}.pcm")
+
+    with timed("synthesize"):
+        audio_secs = synthetic_pcm(pcm_path, duration, seed=seed)
+
+    with timed("silences"):
+        points = energy_silences(pcm_path)
+
+    with timed("plan"):
+        segments = plan_segments(points)
+        greedy = list(greedy_segments(points))
+
+    with timed("vad"):
+        noise_floor = NoiseFloor(pcm_path)
+        regions = [vad_regions(pcm_path, *segment, noise_floor) for segment in segments]
+
+    with timed("load"):
+        backend.load()
+
+    batcher = DynamicBatcher(backend, batch_size=batch_size)
+    with timed("transcribe"):
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(
+                pool.map(
+                    lambda segment, regions: transcribe_pcm_segment(
+                        batcher, *segment, pcm_path, regions
+                    ),
+                    segments,
+                    regions,
+                )
+            )
+
+    os.remove(pcm_path)
+
+    for stage in stages.values():
+        stage["realtime_factor"] = audio_secs / stage["secs"] if stage["secs"] else None
+    processing_secs = sum(
+        stages[stage]["secs"] for stage in ("silences", "plan", "vad", "transcribe")
+    )
+    speech_secs = sum(result["speech_secs"] for result in results)
+
+    return {
+        "config": {
+            "backend": backend.name,
+            "model_id": backend.model_id,
+            "duration": duration,
+            "batch_size": batch_size,
+            "concurrency": concurrency,
+            "seed": seed,
+        },
+        "audio_secs": audio_secs,
+        "stages": stages,
+        # model load is left out, it is paid once per container
+        "realtime_factor": audio_secs / processing_secs,
+        "peak_rss_mb": peak_rss_mb(),
+        "silences": len(points) - 1,
+        "vad": {
+            "enabled": VAD_FILTER,
+            "speech_secs": speech_secs,
+            "saved": 1 - speech_secs / audio_secs,
+            "recall": vad_recall(workdir, seed=seed),
+        },
+        "chunks": sum(len(result["chunks"]) for result in results),
+        "segments": segment_balance(segments),
+        "greedy_segments": segment_balance(greedy),
+        "batcher": batcher.metrics(),
+    }
+
+
+def benchmark_backend(model: str) -> ASRBackend:
+    if model == "mock":
+        return MockBackend()
+    # faster-whisper fetches model sizes like "tiny" from the hub
+    return CTranslate2Backend(model, model, cpu_threads=4)
+
+
+@stub.function(image=cpu_image, cpu=4, volumes={DATA_DIR: volume}, timeout=60 * 60)
+def transcription_benchmark(model: str = "mock", **kwargs) -> dict:
+    """
+    run_benchmark on a CPU container, with a mock model or a small
+    faster-whisper one.
+    """
+    return run_benchmark(benchmark_backend(model), **kwargs)
+
+
+@stub.local_entrypoint()
+def benchmark(
+    model: str = "mock",
+    duration: float = 600.0,
+    batch_size: int = 24,
+    concurrency: int = WHISPER_CONCURRENT_INPUTS,
+    seed: int = 0,
+    output: str = "",
+):
+    import json
+    import subprocess
+
+    result = transcription_benchmark.remote(
+        model,
+        duration=duration,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        seed=seed,
+    )
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    result = {"commit": commit, **result}
+
+    report = json.dumps(result, indent=2)
+    print(report)
+    if output:
+        with open(output, "w") as f:
+            f.write(report)
@@ -1,40 +1,176 @@
 import logging
+import os
+from contextlib import contextmanager
 
-from modal import Image, Volume, method
+from modal import Image, Secret, Volume, method
 
-from yt_university.config import DATA_DIR
+from yt_university.config import AUDIO_CACHE_DIR, AUDIO_FORMAT, DATA_DIR
 from yt_university.stub import stub
 
 downloader_image = (
-    Image.debian_slim(python_version="3.10").apt_install("ffmpeg").pip_install("yt-dlp")
+    Image.debian_slim(python_version="3.10")
+    .apt_install("ffmpeg")
+    .pip_install("yt-dlp", "asyncpg", "sqlalchemy")
 )
 
 volume = Volume.from_name("yt-university-cache", create_if_missing=True)
 
 logger = logging.getLogger(__name__)
 
+# content-addressed audio lives in AUDIO_CACHE_DIR/<sha256>.<ext>, the index maps
+# a (video id, format) pair to it so repeat jobs never touch the network
+CACHE_INDEX_DIR = f"{AUDIO_CACHE_DIR}index/"
+
+# yt-dlp errors of videos that no retry will download
+UNAVAILABLE_RE = (
+    r"Private video|Video unavailable|not available|has been removed|"
+    r"members-only|Sign in to confirm your age|HTTP Error 40[134]"
+)
+
+
+class VideoUnavailable(Exception):
+    """
+    A video that can't be downloaded, such as a private or removed one.
+    Pipeline stages don't retry it, see services.process.is_transient.
+    """
+
+
+@contextmanager
+def raise_unavailable(video_url: str):
+    """
+    Re-raise yt-dlp errors of unavailable videos as VideoUnavailable. It can
+    be unpickled by callers without yt-dlp, unlike the error itself.
+    """
+    import re
+
+    from yt_dlp.utils import DownloadError, ExtractorError
+
+    try:
+        yield
+    except DownloadError as e:
+        cause = e.exc_info[1] if e.exc_info else None
+        expected = isinstance(cause, ExtractorError) and cause.expected
+        if expected or re.search(UNAVAILABLE_RE, str(e)):
+            raise VideoUnavailable(f"{video_url}: {e}") from None
+        raise
+
+
+def cache_key(video_id: str, format: str) -> str:
+    import hashlib
+
+    return f"{video_id}.{hashlib.sha1(format.encode()).hexdigest()[:12]}"
+
+
+def file_digest(path: str) -> str:
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def flatten_playlist(ydl, info):
+    for entry in info.get("entries") or []:
+        # channels list their tabs (videos, shorts, ...) as nested playlists
+        if entry.get("_type") == "playlist" or entry.get("ie_key") == "YoutubeTab":
+            if not entry.get("entries"):
+                entry = ydl.extract_info(entry["url"], download=False)
+            yield from flatten_playlist(ydl, entry)
+        elif entry.get("id"):
+            yield {
+                "id": entry["id"],
+                "title": entry.get("title"),
+                "duration": entry.get("duration"),
+            }
+
+
+def record_cache_access(hit: bool, timeout: float = 5.0):
+    """
+    Count a lookup of the audio cache. Best effort, a database that is down
+    or slow is logged rather than failing the download.
+    """
+    import asyncio
+
+    from yt_university.crud.metrics import increment_counter
+    from yt_university.database import get_db_session
+
+    async def increment():
+        async with get_db_session() as session:
+            await increment_counter(session, f"audio:{'hits' if hit else 'misses'}")
+
+    try:
+        # Downloader methods are synchronous, there is no running loop
+        asyncio.run(asyncio.wait_for(increment(), timeout))
+    except Exception as e:
+        logger.warning(f"Failed to count audio cache access: {e!r}")
+
+
+async def get_cache_stats(session) -> dict:
+    from yt_university.crud.metrics import get_counters
+
+    counts = await get_counters(session, ["audio:hits", "audio:misses"])
+    hits, misses = counts["audio:hits"], counts["audio:misses"]
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else None,
+    }
+
 
 @stub.cls(
     container_idle_timeout=5,
     image=downloader_image,
+    secrets=[Secret.from_name("university")],
     timeout=60 * 10,
     volumes={DATA_DIR: volume},
 )
 class Downloader:
     @method()
-    def run(self, url):
-        video_path, thumbnail_path, meta_dict = self.get_youtube(url)
-        # wav_path = self.convert_to_wav(video_path)
+    def run(self, url, download=True):
+        with raise_unavailable(url):
+            video_path, thumbnail_path, meta_dict = self.get_youtube(url, download)
         return video_path, thumbnail_path, meta_dict
 
-    def get_youtube(self, video_url):
+    @method()
+    def list_playlist(self, playlist_url):
+        """
+        Lists the videos of a playlist or channel without downloading them.
+        """
+        import yt_dlp
+
+        ydl_opts = {"extract_flat": "in_playlist", "quiet": True}
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(playlist_url, download=False)
+            entries = list(flatten_playlist(ydl, info))
+
+        logger.info(f"Found {len(entries)} videos in {playlist_url}")
+        return entries
+
+    def get_youtube(self, video_url, download=True):
         """
         Downloads the audio from a YouTube video and saves metadata to a .info.json file.
+        With download=False only the metadata is extracted, and no paths are returned.
+        Audio already in the cache is returned without any network access.
         """
         import yt_dlp
 
+        from yt_university.helper import get_youtube_video_id
+
+        if download:
+            # index entries written by other Downloader containers
+            volume.reload()
+            cached = self.lookup_cache(get_youtube_video_id(video_url), AUDIO_FORMAT)
+            record_cache_access(hit=cached is not None)
+            if cached:
+                logger.info(f"Cache hit for {video_url}: {cached['path']}")
+                return cached["path"], cached["thumbnail_path"], cached["metadata"]
+
         ydl_opts = {
-            "format": "bestaudio[ext=m4a]",
+            "format": AUDIO_FORMAT,
             "writethumbnail": True,
             "outtmpl": f"{DATA_DIR}%(id)s.%(ext)s",
         }
@@ -57,36 +193,77 @@ class Downloader:
             info = ydl.extract_info(video_url, download=False)
             meta_dict = {key: info.get(key, "") for key in metadata_keys}
             logger.info(meta_dict)
-            ydl.process_info(info)
+            if not download:
+                return None, None, meta_dict
 
-        video_path = f"{DATA_DIR}{meta_dict['id']}.{info['ext']}"
-        thumbnail_path = f"{DATA_DIR}{meta_dict['id']}.webp"
+            video_path = f"{DATA_DIR}{meta_dict['id']}.{info['ext']}"
+            # a complete file from an earlier run that predates the cache index
+            if not os.path.exists(video_path):
+                ydl.process_info(info)
 
+        thumbnail_path = f"{DATA_DIR}{meta_dict['id']}.webp"
         logger.info(f"Successfully downloaded {video_url} to {video_path}")
+
+        entry = self.add_to_cache(
+            video_path, thumbnail_path, meta_dict, AUDIO_FORMAT, info["ext"]
+        )
         volume.commit()
 
-        return video_path, thumbnail_path, meta_dict
+        return entry["path"], thumbnail_path, meta_dict
 
-    def convert_to_wav(self, video_file_path, offset=0):
+    def lookup_cache(self, video_id, format, verify=False):
         """
-        Converts an m4a audio file to WAV format using ffmpeg.
+        Returns the cache index entry for a video and format, or None when the
+        audio is missing, truncated, or (with verify=True) fails its checksum.
         """
-        import os
+        import json
 
-        if not os.path.exists(video_file_path):
-            raise FileNotFoundError("m4a file not found.")
+        index_path = f"{CACHE_INDEX_DIR}{cache_key(video_id, format)}.json"
+        if not os.path.exists(index_path):
+            return None
 
-        out_path = video_file_path.replace("m4a", "wav")
-        if os.path.exists(out_path):
-            logger.info(f"WAV file already exists: {out_path}")
-            return out_path
+        with open(index_path) as f:
+            entry = json.load(f)
 
-        offset_args = f"-ss {offset}" if offset > 0 else ""
-        conversion_command = f'ffmpeg -hide_banner -v warning -stats {offset_args} -i "{video_file_path}" -ar 16000 -ac 1 -c:a pcm_s16le "{out_path}"'
-        if os.system(conversion_command) != 0:
-            raise RuntimeError("Error converting file to WAV.")
+        path = entry["path"]
+        if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            logger.warning(f"Dropping stale cache entry {index_path}")
+            return None
+        if verify and file_digest(path) != entry["sha256"]:
+            logger.warning(f"Checksum mismatch for cache entry {index_path}")
+            return None
 
-        logger.info(f"Conversion to WAV ready: {out_path}")
-        volume.commit()
+        return entry
+
+    def add_to_cache(self, video_path, thumbnail_path, meta_dict, format, ext):
+        """
+        Moves a downloaded file to its content address and indexes it.
+        """
+        import json
+        import time
+
+        sha256 = file_digest(video_path)
+        size = os.path.getsize(video_path)
+        path = f"{AUDIO_CACHE_DIR}{sha256}.{ext}"
+
+        os.makedirs(CACHE_INDEX_DIR, exist_ok=True)
+        if os.path.exists(path):
+            os.remove(video_path)
+        else:
+            os.replace(video_path, path)
+
+        entry = {
+            "video_id": meta_dict["id"],
+            "format": format,
+            "path": path,
+            "sha256": sha256,
+            "size": size,
+            "thumbnail_path": thumbnail_path,
+            "metadata": meta_dict,
+            "created_at": time.time(),
+        }
+        index_path = f"{CACHE_INDEX_DIR}{cache_key(meta_dict['id'], format)}.json"
+        with open(index_path, "w") as f:
+            json.dump(entry, f)
 
-        return out_path
+        return entry
@@ -0,0 +1,86 @@
+from yt_university.config import ASR_COST_PER_SEC, LLM_PRICES
+
+# of the video_metric rows, summed per stage by get_pipeline_metrics
+SUMMED_FIELDS = (
+    "wall_secs",
+    "queue_secs",
+    "audio_secs",
+    "input_tokens",
+    "output_tokens",
+    "cost_usd",
+)
+STAGES = (
+    "queue",
+    "download",
+    "segmentation",
+    "transcribe_segment",
+    "transcribe",
+    "summarize",
+    "categorize",
+)
+
+
+def llm_cost(model: str, input_tokens: int, output_tokens: int) -> float | None:
+    if model not in LLM_PRICES:
+        return None
+    input_price, output_price = LLM_PRICES[model]
+    return (input_tokens * input_price + output_tokens * output_price) / 1e6
+
+
+def asr_cost(backend: str, secs: float) -> float | None:
+    if backend not in ASR_COST_PER_SEC:
+        return None
+    return ASR_COST_PER_SEC[backend] * secs
+
+
+def usage_metrics(stage: str, usage: dict, started_at: float) -> dict:
+    """
+    A metrics row from the usage reported by a summarize function, queue
+    time being how long the call took to start after started_at.
+    """
+    return {
+        "stage": stage,
+        "queue_secs": max(usage["started_at"] - started_at, 0.0),
+        "input_tokens": usage["input_tokens"],
+        "output_tokens": usage["output_tokens"],
+        "cost_usd": llm_cost(
+            usage["model"], usage["input_tokens"], usage["output_tokens"]
+        ),
+        # no requests were made when the output came from the cache
+        "details": {"model": usage["model"], "requests": usage["requests"]},
+    }
+
+
+async def record_metrics(
+    session, video_id: str, metrics: list[dict], job_id: str | None = None
+):
+    """
+    Store metrics rows of a video, get_pipeline_metrics sums them per stage.
+    """
+    from yt_university.crud.metrics import add_video_metrics
+
+    await add_video_metrics(
+        session, video_id, [{**metric, "job_id": job_id} for metric in metrics]
+    )
+
+
+async def get_pipeline_metrics(session) -> dict:
+    from yt_university.crud.metrics import get_stage_totals
+
+    totals = await get_stage_totals(session, SUMMED_FIELDS)
+    empty = {"runs": 0, **{field: 0 for field in SUMMED_FIELDS}}
+    stages = {stage: totals.get(stage, empty) for stage in STAGES}
+
+    # segments are already part of their transcribe stage
+    cost = sum(
+        totals["cost_usd"]
+        for stage, totals in stages.items()
+        if stage != "transcribe_segment"
+    )
+    audio_hours = stages["transcribe"]["audio_secs"] / 3600
+    return {
+        "stages": stages,
+        "cost_usd": cost,
+        "audio_hours": audio_hours,
+        "cost_per_audio_hour": cost / audio_hours if audio_hours else None,
+    }
@@ -1,18 +1,265 @@
 import logging
+import os
+import time
+from datetime import datetime
 
+from fastapi import HTTPException
 from modal import Secret, Volume
 
-from yt_university.config import DATA_DIR
-from yt_university.crud.video import upsert_video
-from yt_university.services.download import Downloader
-from yt_university.services.summarize import categorize_text, generate_summary
-from yt_university.services.transcribe import transcribe
-from yt_university.stub import shared_webapp_image, stub
+from yt_university.config import COMBINED_SUMMARY, DATA_DIR, STREAM_TRANSCRIPTION
+from yt_university.crud.video import get_video, upsert_video
+from yt_university.helper import get_youtube_video_id
+from yt_university.services.download import Downloader, VideoUnavailable
+from yt_university.services.metrics import record_metrics, usage_metrics
+from yt_university.services.retry import RetryPolicy
+from yt_university.services.summarize import (
+    categorize_text,
+    generate_summary,
+    summarize_and_categorize,
+)
+from yt_university.services.transcribe import (
+    SpeechTally,
+    stream_pcm_path,
+    transcribe,
+    transcribe_stream,
+)
+from yt_university.stub import shared_webapp_image, stage_calls, stub
 
 logger = logging.getLogger(__name__)
 
 volume = Volume.from_name("yt-university-cache", create_if_missing=True)
 
+# Ordered pipeline stages. Each one records a checkpoint on the video once its
+# outputs are stored, so a rerun resumes from the first incomplete stage.
+STAGES = ("download", "transcribe", "summarize", "categorize")
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Whether a stage error may go away on retry. Unavailable videos and the
+    HTTPExceptions of the CRUD functions fail the same way every time.
+    """
+    return not isinstance(error, VideoUnavailable | HTTPException)
+
+
+STAGE_RETRIES = {
+    "download": RetryPolicy(max_attempts=3, base_delay=5.0, retry_on=is_transient),
+    "transcribe": RetryPolicy(max_attempts=2, base_delay=30.0, retry_on=is_transient),
+    "summarize": RetryPolicy(max_attempts=4, base_delay=2.0, retry_on=is_transient),
+    "categorize": RetryPolicy(max_attempts=4, base_delay=2.0, retry_on=is_transient),
+}
+
+# what summarize and categorize used to store when they failed
+FAILURE_PLACEHOLDERS = ("Failed to generate summary.", "Failed to categorize summary.")
+
+
+def load_checkpoints(video) -> dict:
+    """
+    Completed stages of a video, with their recorded outputs.
+
+    Videos processed before checkpoints existed are inferred from the
+    columns each stage writes.
+    """
+    if video is None:
+        return {}
+
+    inferred = video.checkpoints is None
+    checkpoints = {} if inferred else dict(video.checkpoints)
+
+    for stage, column in zip(STAGES, ("title", "transcription", "summary", "category")):
+        value = getattr(video, column)
+        if value is None or value in FAILURE_PLACEHOLDERS:
+            # a failure stored as content is redone, with every stage after it
+            for later in STAGES[STAGES.index(stage) :]:
+                checkpoints.pop(later, None)
+            break
+        if inferred:
+            checkpoints[stage] = {}
+    return checkpoints
+
+
+def spawn_once(key: str, function, *args, **kwargs):
+    """
+    Spawn function under an idempotency key. While a call for the key is
+    pending or unrecorded, a rerun of process attaches to it instead of
+    repeating the work.
+    """
+    from modal.functions import FunctionCall
+
+    call_id = stage_calls.get(key, None)
+    if call_id:
+        logger.info(f"Attaching to call {call_id} for {key}")
+        return FunctionCall.from_id(call_id)
+
+    call = function.spawn(*args, **kwargs)
+    stage_calls[key] = call.object_id
+    return call
+
+
+def get_once(key: str, function, *args, **kwargs):
+    call = spawn_once(key, function, *args, **kwargs)
+    try:
+        return call.get()
+    except Exception:
+        # the next attempt has to spawn a fresh call
+        stage_calls.pop(key, None)
+        raise
+
+
+def stages_complete(checkpoints: dict | None, transcribed: bool) -> bool:
+    if checkpoints is None:
+        return transcribed
+    return all(stage in checkpoints for stage in STAGES)
+
+
+def is_processed(video) -> bool:
+    return stages_complete(video.checkpoints, video.transcription is not None)
+
+
+# Each runner returns the columns to store on the video, the outputs to record
+# in its checkpoint and a list of metrics rows. process adds the stage's wall
+# time to its row, see services.metrics.
+
+
+async def run_download(session, video_url: str, user_id: str, state: dict, key: str):
+    # when streaming, the audio is fetched by the transcribe stage itself
+    audio_path, _, metadata = get_once(
+        key, Downloader().run, video_url, download=not STREAM_TRANSCRIPTION
+    )
+
+    volume.reload()
+
+    video_data = {
+        "id": metadata["id"],
+        "url": video_url,
+        "title": metadata["title"],
+        "description": metadata["description"],
+        "duration": metadata["duration"],
+        "language": metadata["language"],
+        "channel": metadata["channel"],
+        "channel_id": metadata["channel_id"],
+        "uploaded_at": metadata["upload_date"],
+        "thumbnail": metadata["thumbnail"],
+        "user_id": state.get("user_id") or user_id,
+    }
+    metrics = [{"stage": "download", "audio_secs": metadata["duration"]}]
+    return video_data, {"audio_path": audio_path} if audio_path else {}, metrics
+
+
+async def run_transcribe(session, video_url: str, user_id: str, state: dict, key: str):
+    """
+    Stores each segment as it arrives, so the API can serve a partial
+    transcript and a retry only transcribes the segments still missing.
+    The stored segments take the place of an idempotency key here.
+    """
+    from yt_university.crud.transcript import (
+        add_transcript_segment,
+        assemble_transcription,
+        get_transcript_segments,
+        transcript_gaps,
+    )
+
+    video_id = get_youtube_video_id(video_url)
+    done = [
+        (segment.start, segment.end)
+        for segment in await get_transcript_segments(session, video_id)
+    ]
+
+    outputs = {}
+    if STREAM_TRANSCRIPTION:
+        segments = transcribe_stream.remote_gen.aio(video_url, done=done)
+        outputs["audio_path"] = stream_pcm_path(video_url)
+    else:
+        segments = transcribe.remote_gen.aio(state["audio_path"], done=done)
+
+    # of the segments transcribed by this run, stored ones are not counted again
+    tally = SpeechTally()
+    metrics = []
+    # the decoded length once segmentation reports it
+    duration = None
+    async for item in segments:
+        metrics.append(item.pop("metrics"))
+        if metrics[-1]["stage"] == "segmentation":
+            duration = metrics[-1]["audio_secs"]
+        if "chunks" in item:
+            await add_transcript_segment(session, video_id, tally.add(item))
+    outputs["vad"] = {
+        "audio_secs": tally.audio_secs,
+        "speech_secs": tally.speech_secs,
+        "saved": tally.saved(),
+    }
+    metrics.append(
+        {
+            "stage": "transcribe",
+            "audio_secs": tally.audio_secs,
+            "cost_usd": sum(
+                metric.get("cost_usd") or 0.0
+                for metric in metrics
+                if metric["stage"] == "transcribe_segment"
+            ),
+            "details": outputs["vad"],
+        }
+    )
+
+    segments = await get_transcript_segments(session, video_id)
+    if duration is None:
+        # the download only has the duration to the second
+        gaps = transcript_gaps(segments, state.get("duration"), duration_error=1.0)
+    else:
+        gaps = transcript_gaps(segments, duration)
+    if gaps:
+        # the retry only transcribes the segments still missing
+        raise RuntimeError(
+            f"Transcript of {video_id} is missing {len(gaps)} stretches: {gaps}"
+        )
+    return {"transcription": assemble_transcription(segments)}, outputs, metrics
+
+
+async def run_summarize(session, video_url: str, user_id: str, state: dict, key: str):
+    started_at = time.time()
+    if COMBINED_SUMMARY:
+        result, usage = get_once(
+            key,
+            summarize_and_categorize,
+            state["title"],
+            state["transcription"],
+            with_usage=True,
+        )
+        metrics = [usage_metrics("summarize", usage, started_at)]
+        # carried to the categorize stage, which only calls the LLM without it
+        category = result.pop("category")
+        return result, {"category": category}, metrics
+
+    columns, usage = get_once(
+        key,
+        generate_summary,
+        state["title"],
+        state["transcription"],
+        with_usage=True,
+    )
+    return columns, {}, [usage_metrics("summarize", usage, started_at)]
+
+
+async def run_categorize(session, video_url: str, user_id: str, state: dict, key: str):
+    category = state.get("category")
+    if category is not None:
+        # returned with the summary
+        return {"category": category}, {}, []
+
+    started_at = time.time()
+    category, usage = get_once(
+        key, categorize_text, state["title"], state["summary"], with_usage=True
+    )
+    return {"category": category}, {}, [usage_metrics("categorize", usage, started_at)]
+
+
+STAGE_RUNNERS = {
+    "download": run_download,
+    "transcribe": run_transcribe,
+    "summarize": run_summarize,
+    "categorize": run_categorize,
+}
+
 
 @stub.function(
     container_idle_timeout=5,
@@ -22,49 +269,99 @@ volume = Volume.from_name("yt-university-cache", create_if_missing=True)
     volumes={DATA_DIR: volume},
     keep_warm=1,
 )
-async def process(video_url: str, user_id: str):
+async def process(video_url: str, user_id: str, job_id: str | None = None):
+    from yt_university.crud.job import get_job, update_job
     from yt_university.database import get_db_session
     from yt_university.models import Video
 
-    downloader = Downloader()
+    video_id = get_youtube_video_id(video_url)
+
+    async with get_db_session() as session:
+        video = await get_video(
+            session,
+            video_id,
+            load_columns=[Video.checkpoints, Video.transcription, Video.summary],
+        )
+        checkpoints = load_checkpoints(video)
 
-    download_call = downloader.run.spawn(video_url)
-    result = download_call.get()
-    audio_path, _, metadata = result
+        state = {}
+        if video:
+            state.update(
+                user_id=video.user_id,
+                title=video.title,
+                transcription=video.transcription,
+                summary=video.summary,
+            )
+        for outputs in checkpoints.values():
+            state.update(outputs)
 
-    volume.reload()
+        volume.reload()
+        if (
+            not STREAM_TRANSCRIPTION
+            and "transcribe" not in checkpoints
+            and not os.path.exists(state.get("audio_path") or "")
+        ):
+            # the audio is gone from the volume, it has to be fetched again
+            checkpoints.pop("download", None)
 
-    video = Video(
-        id=metadata["id"],
-        url=video_url,
-        title=metadata["title"],
-        description=metadata["description"],
-        duration=metadata["duration"],
-        language=metadata["language"],
-        channel=metadata["channel"],
-        channel_id=metadata["channel_id"],
-        uploaded_at=metadata["upload_date"],
-        thumbnail=metadata["thumbnail"],
-        user_id=user_id,
-        favorite_count=0,
-    )
+        job = await get_job(session, job_id) if job_id else None
+        if job and job.started_at:
+            # how long the job waited for a slot before it was dispatched
+            queue_secs = (job.started_at - job.created_at).total_seconds()
+            await record_metrics(
+                session,
+                video_id,
+                [{"stage": "queue", "queue_secs": max(queue_secs, 0.0)}],
+                job_id,
+            )
 
-    async with get_db_session() as session:
-        video = await upsert_video(session, video.id, video.to_dict())
+        for stage in STAGES:
+            if stage in checkpoints:
+                logger.info(f"Skipping completed stage {stage} for {video_id}")
+                continue
 
-        transcription = transcribe.spawn(audio_path).get()
-        video_data = await upsert_video(
-            session, video.id, {"transcription": transcription}
-        )
+            logger.info(f"Running stage {stage} for {video_id}")
+            if job_id:
+                # also serves as the job's heartbeat through updated_at
+                await update_job(session, job_id, {"stage": stage})
+
+            key = f"{video_id}:{stage}"
+            t0 = time.monotonic()
+            try:
+                video_data, outputs, metrics = await STAGE_RETRIES[stage].run(
+                    STAGE_RUNNERS[stage], session, video_url, user_id, state, key
+                )
+            except Exception as e:
+                # recorded on the job, the dispatcher marks it failed on re-raise
+                logger.error(f"Stage {stage} failed for {video_id}: {e}")
+                if job_id:
+                    await update_job(session, job_id, {"error": f"{stage}: {e}"})
+                raise
 
-        summary = generate_summary.spawn(video.title, transcription).get()
-        video_data = await upsert_video(session, video.id, {"summary": summary})
+            checkpoints[stage] = {
+                "completed_at": datetime.utcnow().isoformat(),
+                **outputs,
+            }
+            video = await upsert_video(
+                session, video_id, {**video_data, "checkpoints": dict(checkpoints)}
+            )
+            # recorded, a rerun no longer needs the call
+            stage_calls.pop(key, None)
 
-        category = categorize_text.spawn(video.title, summary).get()
-        video_data = await upsert_video(session, video.id, {"category": category})
+            stage_metrics = next(
+                (metric for metric in metrics if metric["stage"] == stage), None
+            )
+            if stage_metrics is None:
+                stage_metrics = {"stage": stage}
+                metrics.append(stage_metrics)
+            # retries included
+            stage_metrics["wall_secs"] = time.monotonic() - t0
+            await record_metrics(session, video_id, metrics, job_id)
+            state.update(video_data)
+            state.update(outputs)
 
         # related = get_related_content.spawn(video.url).get()
         # print(related)
         # video_data = await upsert_video(session, video.id, {"related_content": related})
 
-    return video_data
+    return video
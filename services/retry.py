@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the delay before retry n is drawn
+    uniformly from [0, min(max_delay, base_delay * multiplier**n)].
+
+    retry_on is a tuple of the exception types to retry, or a function that
+    tells whether an error is worth retrying.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        multiplier: float = 2.0,
+        retry_on: tuple | Callable[[Exception], bool] = (Exception,),
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.retry_on = retry_on
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * self.multiplier**attempt)
+        )
+
+    def should_retry(self, attempt: int, error: Exception) -> bool:
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if callable(self.retry_on):
+            return self.retry_on(error)
+        return isinstance(error, self.retry_on)
+
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(self.max_attempts):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not self.should_retry(attempt, e):
+                    raise
+                delay = self.delay(attempt)
+                logger.warning(
+                    f"Attempt {attempt + 1} failed ({e}), retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+    async def run(self, fn, *args, **kwargs):
+        for attempt in range(self.max_attempts):
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if not self.should_retry(attempt, e):
+                    raise
+                delay = self.delay(attempt)
+                logger.warning(
+                    f"Attempt {attempt + 1} failed ({e}), retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
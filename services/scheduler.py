@@ -0,0 +1,388 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from modal import Period, Secret
+
+from yt_university.config import (
+    DEFAULT_JOB_DURATION,
+    QUEUED_JOB_TTL_SECS,
+    RUNNING_JOB_TTL_SECS,
+    SCHEDULER_AGING_SECS,
+    SCHEDULER_MAX_RUNNING,
+)
+from yt_university.services.process import process
+from yt_university.stub import scheduler_state, shared_webapp_image, stub
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECS = 5
+# weights below this, zero or negative ones included, are raised to it so
+# every user's deficit still reaches a whole job
+MIN_WEIGHT = 0.01
+
+
+class FairShareScheduler:
+    """
+    Weighted deficit round-robin across per-user queues, shortest job first
+    within each queue, under a global limit on running jobs.
+
+    Jobs are plain dicts so the whole state can be stored in a Modal Dict
+    between dispatcher runs.
+    """
+
+    def __init__(
+        self,
+        max_running: int = SCHEDULER_MAX_RUNNING,
+        weights: dict | None = None,
+        aging_secs: float = SCHEDULER_AGING_SECS,
+    ):
+        self.max_running = max_running
+        self.weights = self.validate_weights(weights or {})
+        self.aging_secs = aging_secs
+
+        self.queues: dict[str, list[dict]] = {}
+        self.running: dict[str, dict] = {}
+        self.deficits: dict[str, float] = {}
+        self.order: list[str] = []
+        self.cursor = 0
+        self.credited = False
+        self.wait_times = deque(maxlen=1000)
+
+    @staticmethod
+    def validate_weights(weights: dict) -> dict:
+        valid = {}
+        for user_id, weight in weights.items():
+            if not isinstance(weight, int | float) or not weight >= MIN_WEIGHT:
+                logger.warning(
+                    f"Invalid scheduler weight {weight!r} for {user_id}, "
+                    f"using {MIN_WEIGHT}"
+                )
+                weight = MIN_WEIGHT
+            valid[user_id] = weight
+        return valid
+
+    def submit(self, job: dict):
+        user_id = job["user_id"]
+        if user_id not in self.queues:
+            self.queues[user_id] = []
+            self.deficits[user_id] = 0.0
+            self.order.append(user_id)
+        self.queues[user_id].append(job)
+
+    def priority(self, job: dict, now: float) -> float:
+        # shorter jobs first, with waiting jobs aging towards the front
+        duration = job.get("duration") or DEFAULT_JOB_DURATION
+        waited = now - job["submitted_at"]
+        return duration / (1 + waited / self.aging_secs)
+
+    def is_eligible(self, job: dict) -> bool:
+        limit = job.get("max_concurrency")
+        if not limit:
+            return True
+        running = sum(
+            1 for other in self.running.values() if other.get("group") == job["group"]
+        )
+        return running < limit
+
+    def pick(self, user_id: str, now: float) -> dict | None:
+        eligible = [job for job in self.queues[user_id] if self.is_eligible(job)]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda job: self.priority(job, now))
+
+    def advance(self):
+        self.cursor += 1
+        self.credited = False
+
+    def next_job(self, now: float | None = None) -> dict | None:
+        now = now or time.time()
+
+        if len(self.running) >= self.max_running:
+            return None
+        if not any(self.pick(user_id, now) for user_id in self.order):
+            return None
+
+        while True:
+            index = self.cursor % len(self.order)
+            user_id = self.order[index]
+
+            if not self.queues[user_id]:
+                # drained queues leave the rotation and don't bank credit
+                self.order.pop(index)
+                del self.queues[user_id]
+                del self.deficits[user_id]
+                self.credited = False
+                continue
+
+            job = self.pick(user_id, now)
+            if job is None:
+                self.advance()
+                continue
+
+            if not self.credited:
+                self.deficits[user_id] += self.weights.get(user_id, 1)
+                self.credited = True
+
+            if self.deficits[user_id] >= 1:
+                self.deficits[user_id] -= 1
+                self.queues[user_id].remove(job)
+                self.running[job["job_id"]] = job
+                self.wait_times.append(now - job["submitted_at"])
+                return job
+
+            self.advance()
+
+    def complete(self, job_id: str):
+        self.running.pop(job_id, None)
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def metrics(self, now: float | None = None) -> dict:
+        now = now or time.time()
+        waits = sorted(self.wait_times)
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else None
+
+        oldest = min(
+            (job["submitted_at"] for queue in self.queues.values() for job in queue),
+            default=None,
+        )
+
+        return {
+            "queued": self.queued(),
+            "running": len(self.running),
+            "max_running": self.max_running,
+            "queue_depth": {
+                user_id: len(queue) for user_id, queue in self.queues.items() if queue
+            },
+            "wait_secs": {
+                "count": len(waits),
+                "mean": sum(waits) / len(waits) if waits else None,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": waits[-1] if waits else None,
+                "oldest_queued": now - oldest if oldest else None,
+            },
+        }
+
+    def to_state(self) -> dict:
+        # queued and running jobs are rebuilt from the job table, only the
+        # fairness bookkeeping has to survive between dispatcher runs
+        return {
+            "deficits": self.deficits,
+            "order": self.order,
+            "cursor": self.cursor,
+            "wait_times": list(self.wait_times),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict | None, **kwargs):
+        scheduler = cls(**kwargs)
+        if state:
+            scheduler.deficits = state["deficits"]
+            scheduler.order = state["order"]
+            scheduler.cursor = state["cursor"]
+            scheduler.wait_times.extend(state["wait_times"])
+            scheduler.queues = {user_id: [] for user_id in scheduler.order}
+        return scheduler
+
+    def known(self, job_id: str) -> bool:
+        return job_id in self.running or any(
+            job["job_id"] == job_id for queue in self.queues.values() for job in queue
+        )
+
+
+def to_task(job) -> dict:
+    return {
+        "job_id": job.id,
+        "url": job.url,
+        "user_id": job.user_id,
+        "duration": job.duration,
+        "group": job.group,
+        "max_concurrency": job.max_concurrency,
+        "call_id": job.call_id,
+        "submitted_at": job.created_at.timestamp(),
+    }
+
+
+async def submit_jobs(session, jobs_data: list[dict], wake: bool = True):
+    """
+    Claim and queue videos for processing, then wake the dispatcher. Videos
+    that already have an in-flight job are left out of the result.
+
+    The job id stands in for a call id until the job is dispatched.
+    """
+    from uuid import uuid4
+
+    from yt_university.crud.job import claim_jobs
+
+    claimed = await claim_jobs(
+        session, [{"id": f"job-{uuid4().hex}", **job_data} for job_data in jobs_data]
+    )
+    if claimed and wake:
+        await dispatch.spawn.aio()
+
+    return claimed
+
+
+async def submit_job(session, job_data: dict):
+    claimed = await submit_jobs(session, [job_data])
+    return claimed[0] if claimed else None
+
+
+def get_scheduler_metrics() -> dict:
+    return scheduler_state.get("metrics", {})
+
+
+@stub.function(
+    image=shared_webapp_image,
+    secrets=[Secret.from_name("university")],
+    schedule=Period(minutes=5),
+    concurrency_limit=1,
+    timeout=24 * 60 * 60,
+)
+async def dispatch():
+    """
+    Single dispatcher feeding the scheduler's picks to process, running for
+    as long as there are queued or running jobs.
+    """
+    from datetime import datetime
+
+    from modal.functions import FunctionCall
+
+    from yt_university.crud.job import get_jobs, update_job
+    from yt_university.database import get_db_session
+
+    scheduler = FairShareScheduler.from_state(
+        await scheduler_state.get.aio("state", None),
+        weights=await scheduler_state.get.aio("weights", {}),
+    )
+
+    async def wait_for(task: dict):
+        await FunctionCall.from_id(task["call_id"]).get.aio()
+
+    tasks = {}
+
+    async with get_db_session() as session:
+        for job in await get_jobs(session, status=["running"]):
+            if job.call_id is None:
+                # the previous dispatcher died between claiming and spawning
+                await update_job(session, job.id, {"status": "queued"})
+                continue
+            task = to_task(job)
+            scheduler.running[job.id] = task
+            tasks[asyncio.create_task(wait_for(task))] = task
+
+        while True:
+            for job in await get_jobs(session, status=["queued"]):
+                if not scheduler.known(job.id):
+                    scheduler.submit(to_task(job))
+
+            while (task := scheduler.next_job()) is not None:
+                # the sweeper may have expired it while it sat in the queue
+                started = await update_job(
+                    session,
+                    task["job_id"],
+                    {"status": "running", "started_at": datetime.utcnow()},
+                    from_status=["queued"],
+                )
+                if not started:
+                    scheduler.complete(task["job_id"])
+                    continue
+
+                call = await process.spawn.aio(
+                    task["url"], task["user_id"], job_id=task["job_id"]
+                )
+                task["call_id"] = call.object_id
+                await update_job(session, task["job_id"], {"call_id": call.object_id})
+                tasks[asyncio.create_task(wait_for(task))] = task
+                logger.info(f"Dispatched {task['job_id']} as call {call.object_id}")
+
+            await scheduler_state.put.aio("state", scheduler.to_state())
+            await scheduler_state.put.aio("metrics", scheduler.metrics())
+
+            if not tasks and not scheduler.queued():
+                break
+
+            done, _ = await asyncio.wait(
+                tasks, timeout=POLL_INTERVAL_SECS, return_when=asyncio.FIRST_COMPLETED
+            )
+            for done_task in done:
+                task = tasks.pop(done_task)
+                scheduler.complete(task["job_id"])
+
+                update_data = {"finished_at": datetime.utcnow(), "status": "succeeded"}
+                if done_task.exception():
+                    logger.error(
+                        f"Job {task['job_id']} failed: {done_task.exception()}"
+                    )
+                    update_data.update(
+                        status="failed", error=str(done_task.exception())
+                    )
+                await update_job(
+                    session, task["job_id"], update_data, from_status=["running"]
+                )
+
+
+@stub.function(
+    image=shared_webapp_image,
+    secrets=[Secret.from_name("university")],
+    schedule=Period(minutes=10),
+)
+async def sweep_jobs():
+    """
+    Expire jobs that have outlived their TTL so they release their claim on
+    the video, and settle running jobs whose call ended without the
+    dispatcher noticing.
+    """
+    from datetime import datetime, timedelta
+
+    from modal.functions import FunctionCall
+
+    from yt_university.crud.job import get_jobs, update_job
+    from yt_university.database import get_db_session
+
+    now = datetime.utcnow()
+    expired = 0
+
+    async with get_db_session() as session:
+        for job in await get_jobs(session, status=["queued"]):
+            if now - job.created_at > timedelta(seconds=QUEUED_JOB_TTL_SECS):
+                await update_job(
+                    session,
+                    job.id,
+                    {"status": "expired", "finished_at": now},
+                    from_status=["queued"],
+                )
+                expired += 1
+
+        for job in await get_jobs(session, status=["running"]):
+            update_data = None
+            if job.call_id:
+                call = FunctionCall.from_id(job.call_id)
+                try:
+                    await call.get.aio(timeout=0)
+                    update_data = {"status": "succeeded"}
+                except TimeoutError:
+                    if now - job.updated_at > timedelta(seconds=RUNNING_JOB_TTL_SECS):
+                        await call.cancel.aio()
+                        update_data = {"status": "expired"}
+                except Exception as e:
+                    update_data = {"status": "failed", "error": str(e)}
+            elif now - job.updated_at > timedelta(seconds=RUNNING_JOB_TTL_SECS):
+                update_data = {"status": "expired"}
+
+            if update_data:
+                await update_job(
+                    session,
+                    job.id,
+                    {**update_data, "finished_at": now},
+                    from_status=["running"],
+                )
+                expired += 1
+
+    logger.info(f"Swept {expired} stale jobs")
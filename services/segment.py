@@ -0,0 +1,115 @@
+import bisect
+import heapq
+import math
+from collections.abc import Iterable, Iterator
+
+from yt_university.config import (
+    SEGMENT_OVERHEAD_SECS,
+    TRANSCRIBE_PARALLELISM,
+    TRANSCRIBE_REALTIME_FACTOR,
+    TRANSCRIBE_SLA_SECS,
+)
+
+# Cut points are the midpoints of detected silences, in seconds. The sources in
+# services.transcribe yield them in order, followed by the total duration.
+
+
+def greedy_segments(
+    points: Iterable[float], min_segment_length: float = 480.0
+) -> Iterator[tuple[float, float]]:
+    """
+    Cut at the first silence at least min_segment_length after the previous
+    cut. Works on a stream of points, but leaves segment lengths uneven.
+    """
+    cur_start = 0.0
+    end = 0.0
+    for end in points:
+        if end - cur_start >= min_segment_length:
+            yield cur_start, end
+            cur_start = end
+
+    if end > cur_start:
+        yield cur_start, end
+
+
+def segment_count(
+    duration: float,
+    parallelism: int = TRANSCRIBE_PARALLELISM,
+    sla_secs: float | None = TRANSCRIBE_SLA_SECS,
+    realtime_factor: float = TRANSCRIBE_REALTIME_FACTOR,
+    min_segment_length: float = 60.0,
+) -> int:
+    """
+    Number of segments to split duration into: one per container, or as many
+    as needed for each to finish within sla_secs when that is set, but never
+    segments shorter than min_segment_length.
+    """
+    count = parallelism
+    if sla_secs:
+        budget = max(sla_secs - SEGMENT_OVERHEAD_SECS, 1.0) * realtime_factor
+        count = math.ceil(duration / budget)
+    return max(1, min(count, int(duration // min_segment_length)))
+
+
+def plan_segments(points: list[float], **kwargs) -> list[tuple[float, float]]:
+    """
+    Split into near-equal segments, snapping each cut to the silence nearest
+    its ideal position. Without a silence within a quarter segment of the
+    ideal cut, it is made there anyway.
+
+    Keyword arguments are passed to segment_count.
+    """
+    if not points:
+        return []
+
+    duration = points[-1]
+    silences = sorted(point for point in points[:-1] if 0 < point < duration)
+    count = segment_count(duration, **kwargs)
+    length = duration / count
+
+    cuts = [0.0]
+    for k in range(1, count):
+        ideal = k * length
+        nearby = silences[
+            bisect.bisect_left(silences, ideal - length / 4) : bisect.bisect_right(
+                silences, ideal + length / 4
+            )
+        ]
+        # cuts must stay in order, snapping backwards past the previous one is not allowed
+        nearby = [point for point in nearby if point > cuts[-1]]
+        cut = min(nearby, key=lambda point: abs(point - ideal)) if nearby else ideal
+        if cut > cuts[-1]:
+            cuts.append(cut)
+    cuts.append(duration)
+
+    return list(zip(cuts, cuts[1:]))
+
+
+def simulate_makespan(
+    segments: list[tuple[float, float]],
+    containers: int,
+    realtime_factor: float = TRANSCRIBE_REALTIME_FACTOR,
+    overhead_secs: float = SEGMENT_OVERHEAD_SECS,
+) -> dict:
+    """
+    Expected wall time of transcribing segments on a number of containers,
+    each input going to the first free container in submission order as
+    starmap does.
+    """
+    durations = [
+        (end - start) / realtime_factor + overhead_secs for start, end in segments
+    ]
+
+    free_at = [0.0] * max(1, containers)
+    for seconds in durations:
+        heapq.heappush(free_at, heapq.heappop(free_at) + seconds)
+
+    makespan = max(free_at)
+    busy = sum(durations)
+    return {
+        "segments": len(segments),
+        "containers": containers,
+        "makespan_secs": makespan,
+        "longest_segment_secs": max(durations, default=0.0),
+        "utilization": busy / (makespan * len(free_at)) if makespan else None,
+    }
@@ -1,27 +1,75 @@
 import logging
-
-from modal import Image, Secret
-
+import math
+import time
+from contextvars import ContextVar
+
+from modal import Image, Secret, Volume
+
+from yt_university.config import (
+    DATA_DIR,
+    LLM_CACHE_DIR,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_MAX_RETRIES,
+    SUMMARIZE_CONCURRENT_INPUTS,
+    SUMMARY_MAX_REDUCE_ROUNDS,
+    SUMMARY_PIECE_TOKENS,
+    SUMMARY_RENDER_CACHE_SIZE,
+    SUMMARY_SINGLE_PASS_TOKENS,
+)
 from yt_university.stub import stub
 
 logger = logging.getLogger(__name__)
 
 summarize_image = Image.debian_slim(python_version="3.10").pip_install(
-    "exa_py", "openai"
+    "exa_py", "httpx", "openai", "tiktoken", "asyncpg", "sqlalchemy"
 )
 
+volume = Volume.from_name("yt-university-cache", create_if_missing=True)
+
+SUMMARY_MODEL = "gpt-4o"
+# bump when a prompt changes, cached LLM outputs are keyed by it
+PROMPT_VERSION = 1
+LLM_CACHE_KINDS = ("summary", "summary_category", "category")
+# per request, a summary can run to thousands of tokens
+SUMMARY_TIMEOUT_SECS = 5 * 60
+CATEGORIZE_TIMEOUT_SECS = 30
+# of the summary JSON, in the order they are rendered
+SUMMARY_SECTIONS = ("tl;dr", "terminologies", "takeaways", "summary")
+# other names for sections, for query strings
+SECTION_ALIASES = {"tldr": "tl;dr"}
+# what categorize_text is given of a text without a tl;dr
+TLDR_FALLBACK_CHARS = 2000
+
 
 # reference
 # - https://www.reddit.com/r/ChatGPT/comments/11pd2um/the_best_prompt_for_summary_youtube/
-def create_prompt(title: str, text: str) -> str:
+def create_prompt(
+    title: str,
+    text: str,
+    categories: list | None = None,
+    source: str = "transcript",
+) -> str:
+    category_format = ',"category": "<category>"' if categories else ""
+    category_instructions = (
+        f"""
+        # Category
+
+        Select the single category from the list below that best fits the video, spelled and cased exactly as shown.
+
+        {categories}
+    """
+        if categories
+        else ""
+    )
+
     return f"""
-        Given the transcript below:
+        Given the {source} below:
         {text}
 
         For the video titled "{title}", write an in-depth analysis that both informs and engages readers. Your narrative should unfold with clarity and insight, reflecting the style of a Paul Graham essay.
 
         Return the essay in JSON with the following format:
-        {{"tl;dr":"content","terminologies": {{"<Term 1>": "<Term 1 content>","<Term 2>": "<Term 2 content>",...}},"takeaways": "<takeaways content>","summary": {{"<Key Idea 1>": "<key idea 1 content>","<Key Idea 2>": "<key idea 2 content>",...}}}}
+        {{"tl;dr":"content","terminologies": {{"<Term 1>": "<Term 1 content>","<Term 2>": "<Term 2 content>",...}},"takeaways": "<takeaways content>","summary": {{"<Key Idea 1>": "<key idea 1 content>","<Key Idea 2>": "<key idea 2 content>",...}}{category_format}}}
 
         Below are instructions for each section of the essay:
 
@@ -41,31 +89,587 @@ def create_prompt(title: str, text: str) -> str:
         # Summary
 
         Your summary should unfold as a detailed and engaging narrative essay, deeply exploring the content of the video. It is broken down into key ideas, each with its own paragraph. Each idea should be well-developed, providing context, explanation, and examples where necessary. The essay should be structured logically, with a clear flow of ideas and transitions between paragraphs. It should be long enough to cover the main points but concise enough to maintain the reader's interest.
+        {category_instructions}
     """
 
 
-def json_to_markdown(data: str) -> str:
+def render_section(section: str, content) -> str:
+    if section == "tl;dr":
+        return f"# tl;dr\n\n{content}\n\n"
+
+    if section == "terminologies":
+        lines = [f"1. {term}: {definition}\n\n" for term, definition in content.items()]
+        return "# Terminologies\n\n" + "".join(lines)
+
+    if section == "takeaways":
+        # the prompt asks for a string, which is already a list in markdown
+        if isinstance(content, str):
+            return f"# Takeaways\n\n{content.strip()}\n\n"
+        lines = [f"- {takeaway}\n" for takeaway in content]
+        return "# Takeaways\n\n" + "".join(lines) + "\n"
+
+    if section == "summary":
+        ideas = [f"## {key_idea}\n\n{text}\n\n" for key_idea, text in content.items()]
+        return "# Summary\n\n" + "".join(ideas)
+
+    raise ValueError(f"Unknown summary section {section!r}")
+
+
+def json_to_markdown(data: str | dict, sections=SUMMARY_SECTIONS) -> str:
+    """
+    Markdown of the given sections of a summary JSON, skipping any the model
+    left out.
+    """
     import json
 
-    data = json.loads(data)
+    if isinstance(data, str):
+        data = json.loads(data)
 
-    markdown = ""
+    return "".join(
+        render_section(section, data[section])
+        for section in sections
+        if data.get(section) is not None
+    )
 
-    markdown += f"# tl;dr\n\n{data['tl;dr']}\n\n"
 
-    markdown += "# Terminologies\n\n"
-    for term, definition in data["terminologies"].items():
-        markdown += f"1. {term}: {definition}\n\n"
+def markdown_to_json(markdown: str) -> dict:
+    """
+    The summary JSON back from markdown as json_to_markdown wrote it, for
+    videos summarized before summary_json was stored. Sections missing from
+    the markdown are left out.
+    """
+    import re
 
-    markdown += "# Takeaways\n\n"
-    for takeaway in data["takeaways"]:
-        markdown += f"- {takeaway}\n"
+    data = {}
+    for title, body in re.findall(
+        r"^# (.+?)\n\n(.*?)(?=^# |\Z)", markdown, re.MULTILINE | re.DOTALL
+    ):
+        section = title.strip().lower()
+        if section == "tl;dr":
+            data[section] = body.strip()
+        elif section == "terminologies":
+            data[section] = dict(re.findall(r"^1\. (.+?): (.*)$", body, re.MULTILINE))
+        elif section == "takeaways":
+            # the first summaries iterated over the takeaways string, with a
+            # bullet for each of its characters
+            if re.fullmatch(r"(- .\n)+\n?", body, re.DOTALL):
+                body = "".join(re.findall(r"- (.)\n", body, re.DOTALL))
+            data[section] = body.strip()
+        elif section == "summary":
+            data[section] = {
+                key_idea: text.strip()
+                for key_idea, text in re.findall(
+                    r"^## (.+?)\n\n(.*?)(?=^## |\Z)", body, re.MULTILINE | re.DOTALL
+                )
+            }
+    return data
+
+
+_rendered = {}
+
+
+def render_summary(key, data: dict, sections: tuple = SUMMARY_SECTIONS) -> str:
+    """
+    json_to_markdown, memoized under key and sections. The key has to change
+    with data, such as a video's id and updated_at.
+    """
+    cache_key = (key, sections)
+    if cache_key not in _rendered:
+        if len(_rendered) >= SUMMARY_RENDER_CACHE_SIZE:
+            # dicts keep insertion order, the oldest rendering goes first
+            del _rendered[next(iter(_rendered))]
+        _rendered[cache_key] = json_to_markdown(data, sections)
+    return _rendered[cache_key]
 
-    markdown += "\n# Summary\n\n"
-    for key_idea, content in data["summary"].items():
-        markdown += f"## {key_idea}\n\n{content}\n\n"
 
-    return markdown
+def summary_sections(names: str) -> tuple:
+    """
+    Sections of a comma-separated list of names, such as "tldr,takeaways".
+    """
+    sections = []
+    for name in names.split(","):
+        name = name.strip().lower()
+        section = SECTION_ALIASES.get(name, name)
+        if section not in SUMMARY_SECTIONS:
+            raise ValueError(f"Unknown summary section {name!r}")
+        if section not in sections:
+            sections.append(section)
+    return tuple(sections)
+
+
+def summary_columns(summary_json: str) -> dict:
+    """
+    The video columns of a summary JSON, the structure and its markdown.
+    """
+    import json
+
+    data = json.loads(summary_json)
+    return {
+        "summary": json_to_markdown(data),
+        "summary_json": data,
+        "tldr": data.get("tl;dr"),
+    }
+
+
+def create_piece_prompt(title: str, piece: dict, index: int, total: int) -> str:
+    return f"""
+        Below is part {index} of {total} of the transcript of the video titled "{title}", from {format_timestamp(piece["start"])} to {format_timestamp(piece["end"])}:
+        {piece["text"]}
+
+        Take notes on this part for an essay on the whole video, which will be written from the notes on every part. Keep every idea, argument, example and figure that matters, in the order they come up, but leave out filler and repetition.
+
+        Return the notes in JSON with the following format:
+        {{"key_ideas": {{"<Key Idea 1>": "<key idea 1 notes>",...}},"terminologies": {{"<Term 1>": "<Term 1 definition>",...}},"takeaways": ["<takeaway 1>",...]}}
+    """
+
+
+def format_timestamp(seconds: float | None) -> str:
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return (
+        f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+    )
+
+
+def count_tokens(text: str) -> int:
+    import tiktoken
+
+    return len(tiktoken.encoding_for_model(SUMMARY_MODEL).encode(text))
+
+
+def split_chunk(chunk: dict, max_tokens: int) -> list[dict]:
+    """
+    Split a chunk into parts of at most max_tokens, spreading its time span
+    over them by tokens.
+    """
+    import tiktoken
+
+    encoding = tiktoken.encoding_for_model(SUMMARY_MODEL)
+    tokens = encoding.encode(chunk["text"])
+    if len(tokens) <= max_tokens:
+        return [chunk]
+
+    start, end = chunk["start"], chunk["end"]
+    timed = start is not None and end is not None
+
+    def at(position: int):
+        return start + (end - start) * position / len(tokens) if timed else None
+
+    return [
+        {
+            **chunk,
+            "start": at(i) if timed else start,
+            "end": at(min(i + max_tokens, len(tokens))) if timed else end,
+            "text": encoding.decode(tokens[i : i + max_tokens]),
+        }
+        for i in range(0, len(tokens), max_tokens)
+    ]
+
+
+def transcript_chunks(transcription: dict | str) -> list[dict]:
+    """
+    Timestamped chunks of a transcription. Plain text, as older callers pass,
+    is split into sentences without timestamps.
+
+    Chunks over SUMMARY_PIECE_TOKENS, such as unpunctuated text, are split by
+    tokens so transcript_pieces can still cut between them.
+    """
+    import re
+
+    if isinstance(transcription, dict):
+        chunks = [
+            {"start": chunk["timestamp"][0], "end": chunk["timestamp"][1], **chunk}
+            for chunk in transcription["chunks"]
+        ]
+    else:
+        chunks = [
+            {"start": None, "end": None, "text": sentence}
+            # split after the space, so joining the sentences gives back the text
+            for sentence in re.split(r"(?<=[.!?]\s)", transcription)
+            if sentence
+        ]
+    return [
+        part for chunk in chunks for part in split_chunk(chunk, SUMMARY_PIECE_TOKENS)
+    ]
+
+
+def transcript_pieces(chunks: list[dict], num_pieces: int) -> list[dict]:
+    """
+    Split chunks into num_pieces of near-equal token counts, cutting only
+    between chunks. Pieces get the text and time span of their chunks.
+    """
+    tokens = [count_tokens(chunk["text"]) for chunk in chunks]
+    target = sum(tokens) / num_pieces
+
+    pieces, current, current_tokens = [], [], 0
+    for chunk, chunk_tokens in zip(chunks, tokens):
+        # cut where the piece would drift further past the target than it is short of it
+        if current and current_tokens + chunk_tokens / 2 > target * (len(pieces) + 1):
+            pieces.append(current)
+            current = []
+        current.append(chunk)
+        current_tokens += chunk_tokens
+    pieces.append(current)
+
+    return [
+        {
+            "start": piece[0]["start"],
+            "end": piece[-1]["end"],
+            "text": "".join(chunk["text"] for chunk in piece).strip(),
+        }
+        for piece in pieces
+    ]
+
+
+def summary_passes(prompt_tokens: int) -> int:
+    """
+    Budget estimate of a transcript's summary: 1 when its prompt fits in a
+    single request, otherwise the number of pieces to map-reduce it in.
+    """
+    if prompt_tokens <= SUMMARY_SINGLE_PASS_TOKENS:
+        return 1
+    return math.ceil(prompt_tokens / SUMMARY_PIECE_TOKENS)
+
+
+_client = None
+_requests = None
+# token usage of the current input, each concurrent input runs in its own task
+_usage: ContextVar[dict | None] = ContextVar("usage", default=None)
+
+
+def get_client():
+    """
+    The container's OpenAI client, created on first use and shared by every
+    concurrent input so connections are kept alive between requests. Points
+    at OPENAI_BASE_URL when set, such as a local OpenAI-compatible server.
+    """
+    import asyncio
+    import os
+
+    import httpx
+    from openai import AsyncOpenAI
+
+    global _client, _requests
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONCURRENCY,
+                    max_keepalive_connections=OPENAI_MAX_CONCURRENCY,
+                ),
+            ),
+        )
+        # requests past the pool size wait here rather than time out on the pool
+        _requests = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    return _client
+
+
+def track_usage() -> dict:
+    """
+    Start counting the requests and tokens of the current input. Returns the
+    usage dict that complete() adds to.
+    """
+    usage = {
+        "model": SUMMARY_MODEL,
+        "requests": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "started_at": time.time(),
+    }
+    _usage.set(usage)
+    return usage
+
+
+async def complete(prompt: str, timeout: float, json_output: bool = False) -> str:
+    client = get_client()
+    kwargs = {"response_format": {"type": "json_object"}} if json_output else {}
+
+    async with _requests:
+        response = await client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=timeout,
+            **kwargs,
+        )
+
+    usage = _usage.get()
+    if usage is not None and response.usage is not None:
+        usage["requests"] += 1
+        usage["input_tokens"] += response.usage.prompt_tokens
+        usage["output_tokens"] += response.usage.completion_tokens
+    return response.choices[0].message.content.strip()
+
+
+async def complete_json(prompt: str) -> str:
+    return await complete(prompt, SUMMARY_TIMEOUT_SECS, json_output=True)
+
+
+async def summarize_piece(title: str, piece: dict, index: int, total: int) -> str:
+    """
+    Notes on one piece of a long transcript, the map step of summarize_json.
+    """
+    notes = await complete_json(create_piece_prompt(title, piece, index, total))
+    return (
+        f"# Part {index} of {total}, {format_timestamp(piece['start'])} to "
+        f"{format_timestamp(piece['end'])}\n{notes}"
+    )
+
+
+async def summary_prompt(
+    title: str, transcription: dict | str, categories: list | None = None
+) -> str:
+    """
+    The prompt for the summary JSON of a transcription, the transcript itself
+    when it fits the budget. Longer transcripts are split into pieces that are
+    summarized concurrently, and the prompt is made of the notes on them
+    instead. Notes that are themselves over budget are reduced again the
+    same way, for at most SUMMARY_MAX_REDUCE_ROUNDS rounds.
+    """
+    import asyncio
+
+    chunks = transcript_chunks(transcription)
+    text = "".join(chunk["text"] for chunk in chunks).strip()
+    source = "transcript"
+    previous_tokens = None
+
+    for reduce_round in range(SUMMARY_MAX_REDUCE_ROUNDS + 1):
+        prompt = create_prompt(title, text, categories, source)
+        prompt_tokens = count_tokens(prompt)
+        num_pieces = summary_passes(prompt_tokens)
+        if num_pieces == 1:
+            return prompt
+        # each round must shrink the prompt, or reducing it again only adds requests
+        if previous_tokens is not None and prompt_tokens >= previous_tokens:
+            raise RuntimeError(
+                f"Notes on {title} did not shrink in round {reduce_round}: "
+                f"{prompt_tokens} tokens from {previous_tokens}"
+            )
+        if reduce_round == SUMMARY_MAX_REDUCE_ROUNDS:
+            break
+        previous_tokens = prompt_tokens
+
+        pieces = transcript_pieces(chunks, num_pieces)
+        logger.info(f"Summarizing {title} in {len(pieces)} pieces")
+        notes = await asyncio.gather(
+            *(
+                summarize_piece(title, piece, index, len(pieces))
+                for index, piece in enumerate(pieces, start=1)
+            )
+        )
+
+        # a note over SUMMARY_PIECE_TOKENS is split so transcript_pieces can cut it
+        chunks = [
+            part
+            for note in notes
+            for part in split_chunk(
+                {"start": None, "end": None, "text": f"{note}\n\n"},
+                SUMMARY_PIECE_TOKENS,
+            )
+        ]
+        text = "".join(chunk["text"] for chunk in chunks).strip()
+        source = "notes on consecutive parts of the video's transcript"
+
+    raise RuntimeError(
+        f"Notes on {title} are still {prompt_tokens} tokens after "
+        f"{SUMMARY_MAX_REDUCE_ROUNDS} reduce rounds"
+    )
+
+
+async def summarize_json(
+    title: str, transcription: dict | str, categories: list | None = None
+) -> str:
+    return await complete_json(await summary_prompt(title, transcription, categories))
+
+
+class JSONSectionParser:
+    """
+    Incremental parser of a JSON object streamed in pieces, returning each
+    top-level member as soon as its value is complete.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.member_start = 0
+
+    def feed(self, text: str) -> list[tuple[str, object]]:
+        import json
+
+        self.buffer += text
+        members = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.member_start = self.position + 1
+            elif char in "}]" or (char == "," and self.depth == 1):
+                # a comma or the closing brace of the object ends a member
+                if self.depth == 1 and char != "]":
+                    member = self.buffer[self.member_start : self.position].strip()
+                    if member:
+                        members.extend(json.loads(f"{{{member}}}").items())
+                    self.member_start = self.position + 1
+                if char != ",":
+                    self.depth -= 1
+            self.position += 1
+        return members
+
+
+async def stream_completion(prompt: str, timeout: float):
+    """
+    Yields the text of a JSON completion as it is generated.
+    """
+    client = get_client()
+
+    async with _requests:
+        stream = await client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"},
+            timeout=timeout,
+            stream=True,
+        )
+        async for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+
+
+def llm_cache_path(kind: str, *inputs) -> str:
+    import hashlib
+    import json
+
+    key = json.dumps([kind, PROMPT_VERSION, SUMMARY_MODEL, *inputs], sort_keys=True)
+    return f"{LLM_CACHE_DIR}{kind}/{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+
+async def record_llm_cache_access(kind: str, outcome: str):
+    from yt_university.crud.metrics import increment_counter
+    from yt_university.database import get_db_session
+
+    async with get_db_session() as session:
+        await increment_counter(session, f"llm:{kind}:{outcome}")
+
+
+async def get_llm_cache_stats(session) -> dict:
+    from yt_university.crud.metrics import get_counters
+
+    counts = await get_counters(
+        session,
+        [
+            f"llm:{kind}:{outcome}"
+            for kind in LLM_CACHE_KINDS
+            for outcome in ("hits", "misses", "bypassed")
+        ],
+    )
+    stats = {}
+    for kind in LLM_CACHE_KINDS:
+        hits = counts[f"llm:{kind}:hits"]
+        misses = counts[f"llm:{kind}:misses"]
+        total = hits + misses
+        stats[kind] = {
+            "hits": hits,
+            "misses": misses,
+            "bypassed": counts[f"llm:{kind}:bypassed"],
+            "hit_rate": hits / total if total else None,
+        }
+    return stats
+
+
+_reload_lock = None
+_reloads_started = 0
+
+
+async def reload_volume():
+    """
+    Reload the volume for a cache miss. Concurrent inputs that miss while a
+    reload is waiting or running share the next one rather than each
+    reloading in turn.
+    """
+    import asyncio
+
+    global _reload_lock, _reloads_started
+    if _reload_lock is None:
+        _reload_lock = asyncio.Lock()
+    missed_at = _reloads_started
+    async with _reload_lock:
+        # a reload started after the miss sees everything the miss could
+        if _reloads_started == missed_at:
+            _reloads_started += 1
+            await volume.reload.aio()
+
+
+async def load_cached_completion(kind: str, inputs: list, use_cache: bool = True):
+    """
+    The cached output for kind and inputs, or None on a miss or when
+    use_cache is False. LLM outputs are cached on the volume by kind,
+    inputs, prompt version and model.
+    """
+    import json
+    import os
+
+    if not use_cache:
+        await record_llm_cache_access(kind, "bypassed")
+        return None
+
+    path = llm_cache_path(kind, *inputs)
+    if not os.path.exists(path):
+        # another container may have stored it since this one last looked
+        await reload_volume()
+        if not os.path.exists(path):
+            await record_llm_cache_access(kind, "misses")
+            return None
+
+    await record_llm_cache_access(kind, "hits")
+    with open(path) as f:
+        return json.load(f)["output"]
+
+
+async def store_completion(kind: str, inputs: list, output):
+    import json
+    import os
+
+    path = llm_cache_path(kind, *inputs)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"output": output}, f)
+    await volume.commit.aio()
+
+
+async def cached_completion(
+    kind: str, inputs: list, compute, use_cache: bool = True, validate=None
+):
+    """
+    The output of awaiting compute(), cached. With use_cache=False the cache
+    is not read, but the fresh output still replaces what it held.
+
+    validate is called on a fresh output before it is stored, an output it
+    raises on is never cached so a retry asks the model again.
+    """
+    output = await load_cached_completion(kind, inputs, use_cache)
+    if output is None:
+        output = await compute()
+        if validate is not None:
+            validate(output)
+        await store_completion(kind, inputs, output)
+    return output
 
 
 @stub.function(
@@ -73,55 +677,167 @@ def json_to_markdown(data: str) -> str:
     secrets=[Secret.from_name("university")],
     container_idle_timeout=5,
     keep_warm=1,
+    timeout=15 * 60,
+    volumes={DATA_DIR: volume},
+    allow_concurrent_inputs=SUMMARIZE_CONCURRENT_INPUTS,
 )
-def generate_summary(title: str, text: str):
-    """
-    Summarize the transcribed text using OpenAI's GPT model.
+async def generate_summary(
+    title: str,
+    transcription: dict | str,
+    use_cache: bool = True,
+    with_usage: bool = False,
+):
     """
-    import os
+    Summarize a transcription, or its text, using OpenAI's GPT model.
+    Returns the summary_columns of the summary.
 
-    from openai import OpenAI
+    With with_usage, returns them and the usage of track_usage.
+    """
+    usage = track_usage()
+    try:
+        summary_json = await cached_completion(
+            "summary",
+            [title, transcription],
+            lambda: summarize_json(title, transcription),
+            use_cache,
+            validate=summary_columns,
+        )
+        columns = summary_columns(summary_json)
+        return (columns, usage) if with_usage else columns
+    except Exception as e:
+        # raised rather than stored as the summary, callers retry or fail the job
+        logger.error(f"Error in summarizing transcription: {str(e)}")
+        raise
 
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+@stub.function(
+    image=summarize_image,
+    secrets=[Secret.from_name("university")],
+    container_idle_timeout=5,
+    keep_warm=1,
+    timeout=15 * 60,
+    volumes={DATA_DIR: volume},
+    allow_concurrent_inputs=SUMMARIZE_CONCURRENT_INPUTS,
+)
+async def summarize_and_categorize(
+    title: str,
+    transcription: dict | str,
+    use_cache: bool = True,
+    with_usage: bool = False,
+):
+    """
+    Summarize and categorize in a single request, the category being part of
+    the summary JSON. The category is None when the model did not return one of
+    CATEGORIES, callers then fall back to categorize_text.
+    """
+    usage = track_usage()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": create_prompt(title, text)}],
-            response_format={"type": "json_object"},
+        summary_json = await cached_completion(
+            "summary_category",
+            [title, transcription, CATEGORIES],
+            lambda: summarize_json(title, transcription, CATEGORIES),
+            use_cache,
+            validate=summary_columns,
         )
-        summary_json = response.choices[0].message.content.strip()
-        print("summary_json", summary_json)
-        summary = json_to_markdown(summary_json)
-        return summary
+        result = summary_result(title, summary_json)
+        return (result, usage) if with_usage else result
     except Exception as e:
         logger.error(f"Error in summarizing transcription: {str(e)}")
-        return "Failed to generate summary."
+        raise
 
 
-def extract_tldr(output_text: str) -> str:
-    import re
+@stub.function(
+    image=summarize_image,
+    secrets=[Secret.from_name("university")],
+    container_idle_timeout=5,
+    keep_warm=1,
+    timeout=15 * 60,
+    volumes={DATA_DIR: volume},
+    allow_concurrent_inputs=SUMMARIZE_CONCURRENT_INPUTS,
+)
+async def stream_summary(title: str, transcription: dict | str, use_cache: bool = True):
+    """
+    summarize_and_categorize, yielding each section of the summary JSON as
+    {"section": name, "content": value} as soon as the model has written it.
+    The last item is the result of summarize_and_categorize.
+
+    Shares its cache with summarize_and_categorize, a cached summary is
+    yielded all at once.
+    """
+    import json
+
+    inputs = [title, transcription, CATEGORIES]
+    summary_json = await load_cached_completion("summary_category", inputs, use_cache)
+
+    if summary_json is None:
+        parser = JSONSectionParser()
+        deltas = []
+        try:
+            prompt = await summary_prompt(title, transcription, CATEGORIES)
+            async for delta in stream_completion(prompt, SUMMARY_TIMEOUT_SECS):
+                deltas.append(delta)
+                for section, content in parser.feed(delta):
+                    yield {"section": section, "content": content}
+        except Exception as e:
+            logger.error(f"Error in summarizing transcription: {str(e)}")
+            raise
+
+        summary_json = "".join(deltas).strip()
+        # raises on a stream that was cut off, before it can be cached
+        result = summary_result(title, summary_json)
+        await store_completion("summary_category", inputs, summary_json)
+    else:
+        for section, content in json.loads(summary_json).items():
+            yield {"section": section, "content": content}
+        result = summary_result(title, summary_json)
+
+    yield result
+
+
+def summary_result(title: str, summary_json: str) -> dict:
+    columns = summary_columns(summary_json)
+    category = validate_category(columns["summary_json"].get("category"))
+    if category is None:
+        logger.warning(f"Invalid category in summary of {title}, falling back")
+
+    return {**columns, "category": category}
+
 
+def validate_category(category) -> str | None:
     """
+    Match category against CATEGORIES, ignoring case and stray quotes.
+    """
+    if not isinstance(category, str):
+        return None
+
+    category = category.strip().strip("'\"").lower()
+    for valid in CATEGORIES:
+        if valid.lower() == category:
+            return valid
+    return None
+
 
+def extract_tldr(output_text: str) -> str:
+    """
     Extracts the TL;DR section from the output text.
 
     Parameters:
         output_text (str): The complete output text generated by the language model.
 
     Returns:
-        str: The extracted TL;DR section or an informative message if the section is not found.
+        str: The extracted TL;DR section, or the start of the text when it has none.
     """
-    # Pattern to capture text starting from TL;DR up to but not including the Intro heading
-    pattern = r"# tl;dr\n\n(.*?)(?=\n\n# Intro)"
+    import re
 
-    # Using re.DOTALL to make '.' match any character including newline
-    match = re.search(pattern, output_text, re.DOTALL)
+    # Pattern to capture text under a TL;DR heading of any level and case, up
+    # to but not including the next heading
+    pattern = r"^#+[ \t]*tl;?dr:?[ \t]*\r?\n(.*?)(?=^#|\Z)"
 
-    if match:
+    match = re.search(pattern, output_text, re.DOTALL | re.IGNORECASE | re.MULTILINE)
+
+    if match and match.group(1).strip():
         return match.group(1).strip()  # Remove any leading/trailing whitespace
-    else:
-        return "TL;DR section not found."
+    return output_text.strip()[:TLDR_FALLBACK_CHARS]
 
 
 CATEGORIES = [
@@ -173,27 +889,34 @@ def create_categorize_prompt(title, text):
     secrets=[Secret.from_name("university")],
     container_idle_timeout=5,
     keep_warm=1,
+    volumes={DATA_DIR: volume},
+    allow_concurrent_inputs=SUMMARIZE_CONCURRENT_INPUTS,
 )
-def categorize_text(title: str, text: str):
-    import os
-
-    from openai import OpenAI
-
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    try:
-        tldr_text = extract_tldr(text)
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "user", "content": create_categorize_prompt(title, tldr_text)}
-            ],
-        )
-        category = response.choices[0].message.content.strip()
-        return category.replace("'", "").replace('"', "")
-    except Exception as e:
-        logger.error(f"Error in categorizing transcription: {str(e)}")
-        return "Failed to categorize summary."
+async def categorize_text(
+    title: str, text: str, use_cache: bool = True, with_usage: bool = False
+):
+    usage = track_usage()
+    tldr_text = extract_tldr(text)
+
+    async def categorize():
+        try:
+            category = await complete(
+                create_categorize_prompt(title, tldr_text), CATEGORIZE_TIMEOUT_SECS
+            )
+        except Exception as e:
+            logger.error(f"Error in categorizing transcription: {str(e)}")
+            raise
+
+        # only a valid category is cached
+        valid_category = validate_category(category)
+        if valid_category is None:
+            raise ValueError(f"Model returned unknown category {category!r}")
+        return valid_category
+
+    category = await cached_completion(
+        "category", [title, tldr_text, CATEGORIES], categorize, use_cache
+    )
+    return (category, usage) if with_usage else category
 
 
 @stub.function(
@@ -214,14 +937,24 @@ def get_related_content(url: str):
 
 
 @stub.local_entrypoint()
-def main():
+def main(path: str = "./example.json"):
+    """
+    Summarize and categorize a saved video locally, without the cache. Set
+    OPENAI_BASE_URL to run it against a local OpenAI-compatible server.
+    """
+    import asyncio
     import json
 
     from dotenv import load_dotenv
 
     load_dotenv()
-    with open("./example.json") as f:
+    with open(path) as f:
         data = json.load(f)
 
-        category = categorize_text.local(data["title"], data["transcription"])
-        print("Categorized as:", category)
+    summary_json = asyncio.run(
+        summarize_json(data["title"], data["transcription"], CATEGORIES)
+    )
+    print(json_to_markdown(summary_json))
+    print(
+        "Categorized as:", validate_category(json.loads(summary_json).get("category"))
+    )
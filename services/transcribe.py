@@ -1,14 +1,70 @@
+import os
+import re
 from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
 
 from modal import Image, Volume, enter, gpu, method
 
-from yt_university.config import DATA_DIR, MODEL_DIR, get_logger
+from yt_university.config import (
+    ASR_BACKEND,
+    CPU_ASR_MAX_DURATION,
+    CPU_ASR_MODEL,
+    DATA_DIR,
+    MODEL_DIR,
+    TRANSCRIBE_PARALLELISM,
+    VAD_FILTER,
+    VAD_MARGIN_DB,
+    VAD_MIN_GAP_SECS,
+    VAD_MODULATION_DB,
+    VAD_PAD_SECS,
+    WHISPER_CONCURRENT_INPUTS,
+    get_logger,
+)
+from yt_university.services.asr import (
+    ASRBackend,
+    CTranslate2Backend,
+    DynamicBatcher,
+    HFWhisperBackend,
+    benchmark_batching,
+)
+from yt_university.services.download import file_digest, raise_unavailable
+from yt_university.services.retry import RetryPolicy
+from yt_university.services.segment import (
+    greedy_segments,
+    plan_segments,
+    simulate_makespan,
+)
 from yt_university.stub import stub
 
 logger = get_logger(__name__)
 
 BASE_MODEL = "openai/whisper-large-v3"
+CPU_MODEL_DIR = f"{MODEL_DIR}{CPU_ASR_MODEL}/"
+SAMPLE_RATE = 16000
+# audio is decoded once to raw 16 kHz mono f32le, the layout Whisper takes as
+# input, so segments can be handed to it as slices of a memory map
+PCM_FORMAT = "f32le"
+PCM_BYTES_PER_SEC = SAMPLE_RATE * 4
+# transcripts of single segments, under <audio sha256>/<backend cache key>/
+TRANSCRIPT_CACHE_DIR = f"{DATA_DIR}transcripts/"
+
+# a sample is silent below this amplitude, as in ffmpeg's silencedetect
+SILENCE_NOISE_DB = -10
+SILENCE_FRAME_SECS = 0.01
+VAD_FRAME_SECS = 0.02
+# frames quieter than this are never speech, whatever the noise floor
+VAD_MIN_DB = -55
+# the noise floor is the quietest stretch of this length in the recording
+VAD_FLOOR_SECS = 0.2
+# bump when speech_regions changes, cached transcripts of its regions are keyed by it
+VAD_VERSION = 2
+SILENCE_END_RE = re.compile(
+    r" silence_end: (?P<end>[0-9]+(\.?[0-9]*)) \| silence_duration: (?P<dur>[0-9]+(\.?[0-9]*))"
+)
+# retries of a single failed segment, on top of its first attempt
+SEGMENT_RETRY = RetryPolicy(max_attempts=2, base_delay=5.0)
+
 volume = Volume.from_name("yt-university-cache", create_if_missing=True)
 
 
@@ -25,6 +81,18 @@ def download_model_to_folder():
     move_cache()
 
 
+def download_cpu_model_to_folder():
+    from faster_whisper import download_model
+
+    download_model(CPU_ASR_MODEL, output_dir=CPU_MODEL_DIR)
+
+
+cpu_image = (
+    Image.debian_slim(python_version="3.10")
+    .pip_install("faster-whisper==1.0.2", "numpy")
+    .run_function(download_cpu_model_to_folder)
+)
+
 image = (
     Image.from_registry("nvidia/cuda:12.4.1-devel-ubuntu22.04", add_python="3.10")
     .apt_install("git", "ffmpeg")
@@ -52,7 +120,8 @@ image = (
 @stub.cls(
     timeout=60 * 10,
     container_idle_timeout=5,
-    allow_concurrent_inputs=1,
+    # segments are packed into shared batches by DynamicBatcher
+    allow_concurrent_inputs=WHISPER_CONCURRENT_INPUTS,
     # using gpu throw index out of bound error from CUDA - unresolved yet
     # on a 2h50m video, T4 cost $0.16 versus A10G at $0.20
     # since processing is asynchronous, ok to use T4
@@ -64,174 +133,968 @@ image = (
 class Whisper:
     """
     Whisper model class for transcribing audio on a per-segment basis.
+
+    Concurrent segments, from any video, share batches on the GPU.
     """
 
     @enter()
     def setup(self):
         """Set up the Whisper model for transcription."""
-        import time
-
-        import torch
-        from transformers import (
-            AutoModelForSpeechSeq2Seq,
-            AutoProcessor,
-            pipeline,
-            utils,
-        )
+        self.batcher = DynamicBatcher(load_backend(gpu_backend()))
 
-        logger.info("🥶 Cold starting inference")
-        start = time.monotonic_ns()
-
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        device_int = 0 if device == "cuda" else -1
-        logger.info(f"Running on {device}")
-        torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-
-        model = AutoModelForSpeechSeq2Seq.from_pretrained(
-            MODEL_DIR,
-            torch_dtype=torch_dtype,
-            use_safetensors=True,
-            attn_implementation="flash_attention_2"
-            if utils.is_flash_attn_2_available() == "cuda"
-            else "sdpa",
-        ).to(device)
-
-        processor = AutoProcessor.from_pretrained(MODEL_DIR)
-
-        self.pipe = pipeline(
-            "automatic-speech-recognition",
-            model=model,
-            tokenizer=processor.tokenizer,
-            feature_extractor=processor.feature_extractor,
-            max_new_tokens=128,
-            torch_dtype=torch_dtype,
-            chunk_length_s=30,
-            batch_size=24,
-            return_timestamps=True,
-            model_kwargs={"attn_implementation": "flash_attention_2"},
-            device=device_int,
+    @method()
+    def transcribe_segment(
+        self, start: float, end: float, audio_filepath: Path, regions=None
+    ):
+        """Transcribe a specific segment of a raw PCM file."""
+        result = transcribe_pcm_segment(
+            self.batcher, start, end, audio_filepath, regions
         )
+        logger.info(f"Batcher: {self.batcher.metrics()}")
+        return result
 
-        duration_s = (time.monotonic_ns() - start) / 1e9
-        logger.info(f"🏎️ Engine started in {duration_s:.0f}s")
+
+@stub.cls(
+    timeout=60 * 10,
+    container_idle_timeout=5,
+    allow_concurrent_inputs=1,
+    cpu=4,
+    image=cpu_image,
+    volumes={DATA_DIR: volume},
+)
+class CPUWhisper:
+    """
+    Whisper on CPU workers, with the same interface as Whisper.
+    """
+
+    @enter()
+    def setup(self):
+        self.backend = load_backend(cpu_backend())
 
     @method()
-    def transcribe_segment(self, start: float, end: float, audio_filepath: Path):
-        """Transcribe a specific segment of an audio file."""
+    def transcribe_segment(
+        self, start: float, end: float, audio_filepath: Path, regions=None
+    ):
+        return transcribe_pcm_segment(self.backend, start, end, audio_filepath, regions)
+
+
+def gpu_backend() -> ASRBackend:
+    return HFWhisperBackend(BASE_MODEL, MODEL_DIR)
+
+
+def cpu_backend() -> ASRBackend:
+    return CTranslate2Backend(CPU_ASR_MODEL, CPU_MODEL_DIR, cpu_threads=4)
+
+
+def load_backend(backend: ASRBackend) -> ASRBackend:
+    import time
+
+    logger.info(f"🥶 Cold starting {backend.name} inference with {backend.model_id}")
+    start = time.monotonic_ns()
 
-        import gc
-        import tempfile
-        import time
+    backend.load()
 
-        import ffmpeg
-        import torch
+    duration_s = (time.monotonic_ns() - start) / 1e9
+    logger.info(f"🏎️ Engine started in {duration_s:.0f}s")
+    return backend
 
+
+class PCMReader:
+    """
+    Opens memory maps of PCM files on the volume for concurrent inputs. The
+    volume is reloaded only when a file is missing or shorter than a segment
+    needs, and only once no map is open, as Modal refuses to reload a volume
+    with open files.
+    """
+
+    def __init__(self):
+        import threading
+
+        self.condition = threading.Condition()
+        self.open_maps = 0
+        self.reloading = False
+
+    @staticmethod
+    def has_audio(audio_filepath: Path, end: float) -> bool:
+        if not os.path.exists(audio_filepath):
+            return False
+        return os.path.getsize(audio_filepath) >= int(end * PCM_BYTES_PER_SEC)
+
+    @contextmanager
+    def open(self, audio_filepath: Path, end: float):
+        import numpy as np
+
+        with self.condition:
+            # a pending reload goes first, or it could wait forever
+            self.condition.wait_for(lambda: not self.reloading)
+            if not self.has_audio(audio_filepath, end):
+                # the file may have been written after this container started
+                self.reloading = True
+                try:
+                    self.condition.wait_for(lambda: self.open_maps == 0)
+                    if not self.has_audio(audio_filepath, end):
+                        volume.reload()
+                finally:
+                    self.reloading = False
+                    self.condition.notify_all()
+            self.open_maps += 1
+
+        try:
+            yield np.memmap(audio_filepath, dtype=np.float32, mode="r")
+        finally:
+            with self.condition:
+                self.open_maps -= 1
+                self.condition.notify_all()
+
+
+pcm_reader = PCMReader()
+
+
+def transcribe_pcm_segment(
+    backend: ASRBackend | DynamicBatcher,
+    start: float,
+    end: float,
+    audio_filepath: Path,
+    regions: list | None = None,
+) -> dict:
+    """
+    Transcribe start to end of a raw PCM file, or only the speech regions
+    within it when given, joined back to back. Timestamps are returned on
+    the original timeline either way.
+
+    Also returns when the call started and the seconds spent in the model,
+    for segment_metrics.
+    """
+    import bisect
+    import gc
+    import time
+
+    import numpy as np
+
+    started_at = time.time()
+    with pcm_reader.open(audio_filepath, end) as audio:
         t0 = time.time()
-        with tempfile.NamedTemporaryFile(suffix=".mp3") as f:
-            (
-                ffmpeg.input(str(audio_filepath))
-                .filter("atrim", start=start, end=end)
-                .output(f.name)
-                .overwrite_output()
-                .run(quiet=True)
-            )
-            # Transcribe the processed audio segment
-            result = self.pipe(
-                f.name, generate_kwargs={"language": "<|en|>", "task": "transcribe"}
-            )
-            logger.info(
-                f"Transcribed segment from {start:.2f} to {end:.2f} in {time.time() - t0:.2f} seconds."
+        # only the pages of this segment are read from the volume, and no copy
+        # is made before the feature extractor
+        if regions is None:
+            regions = [(start, end)]
+            segment = audio[int(start * SAMPLE_RATE) : int(end * SAMPLE_RATE)]
+        else:
+            segment = np.concatenate(
+                [audio[int(s * SAMPLE_RATE) : int(e * SAMPLE_RATE)] for s, e in regions]
+                or [np.empty(0, dtype=np.float32)]
             )
 
-            # Adjust timestamps to original audio timeline
-            for segment in result["chunks"]:
-                restored_timestamp = (
-                    segment["timestamp"][0] + start
-                    if segment["timestamp"][0] is not None
-                    else None,
-                    # Fix for error faced
-                    # Whisper did not predict an ending timestamp, which can happen if audio is cut off in the middle of a word. Also make sure WhisperTimeStampLogitsProcessor was used during generation.
-                    segment["timestamp"][1] + start
-                    if segment["timestamp"][1] is not None
-                    else None,
-                )
-                segment["timestamp"] = restored_timestamp
+        # where each region starts in the audio given to the model
+        offsets = np.cumsum([0.0] + [e - s for s, e in regions[:-1]]).tolist()
 
+        def restore(timestamp):
+            # Whisper did not predict an ending timestamp, which can happen if
+            # audio is cut off in the middle of a word
+            if timestamp is None:
+                return None
+            k = max(bisect.bisect_right(offsets, timestamp) - 1, 0)
+            region_start, region_end = regions[k]
+            return min(region_start + timestamp - offsets[k], region_end)
+
+        result = (
+            backend.transcribe(segment) if len(segment) else {"text": "", "chunks": []}
+        )
+        speech_secs = len(segment) / SAMPLE_RATE
+        transcribe_secs = time.time() - t0
+        logger.info(
+            f"Transcribed segment from {start:.2f} to {end:.2f} "
+            f"({speech_secs:.2f}s of speech) in {transcribe_secs:.2f} seconds."
+        )
+        # a batcher reports the segment's share of its batches, a backend on its
+        # own spends the whole call in the model
+        model_secs = result.pop("model_secs", transcribe_secs)
+
+        # Adjust timestamps to original audio timeline
+        for chunk in result["chunks"]:
+            chunk["timestamp"] = tuple(restore(t) for t in chunk["timestamp"])
+
+        # views of the map keep the file open, which blocks a volume reload
+        del audio, segment
         gc.collect()
-        with torch.no_grad():
-            torch.cuda.empty_cache()
-        return result
+    backend.release()
+    return {
+        **result,
+        "start": start,
+        "end": end,
+        "speech_secs": speech_secs,
+        "started_at": started_at,
+        "transcribe_secs": transcribe_secs,
+        "model_secs": model_secs,
+    }
+
+
+def get_transcriber(duration: float | None = None):
+    """
+    The Whisper deployment to send segments to, and its (unloaded) backend.
+    With ASR_BACKEND=auto, videos up to CPU_ASR_MAX_DURATION go to CPU workers.
+    """
+    if ASR_BACKEND == "ct2" or (
+        ASR_BACKEND == "auto"
+        and duration is not None
+        and duration <= CPU_ASR_MAX_DURATION
+    ):
+        return CPUWhisper(), cpu_backend()
+    return Whisper(), gpu_backend()
+
+
+def pcm_digest(pcm_path: str) -> str:
+    """
+    Content hash of a decoded PCM file, kept in its .done marker.
+    """
+    marker = f"{pcm_path}.done"
+    with open(marker) as f:
+        digest = f.read().strip()
+
+    # markers written before the hash was recorded are empty
+    if not digest:
+        digest = file_digest(pcm_path)
+        with open(marker, "w") as f:
+            f.write(digest)
+    return digest
+
+
+def segment_cache_path(digest: str, backend: ASRBackend, start: float, end: float):
+    # a transcript of the speech regions only differs from one of the whole segment
+    suffix = f".vad{VAD_VERSION}" if VAD_FILTER else ""
+    return f"{TRANSCRIPT_CACHE_DIR}{digest}/{backend.cache_key()}/{start:.3f}-{end:.3f}{suffix}.json"
+
+
+def load_cached_segment(path: str) -> dict | None:
+    import json
+
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def store_segment(path: str, result: dict):
+    import json
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(result, f)
+
+
+@stub.function(image=image, cpu=4, timeout=30 * 60)
+def batching_benchmark(model_id: str = "openai/whisper-tiny", **kwargs) -> dict:
+    """
+    DynamicBatcher against one-at-a-time transcription, on CPU with a small
+    model pulled from the hub. See services.asr.benchmark_batching.
+    """
+    return benchmark_batching(
+        load_backend(HFWhisperBackend(model_id, model_id)), **kwargs
+    )
+
+
+@stub.local_entrypoint()
+def batching(model_id: str = "openai/whisper-tiny", segments: int = 8):
+    import json
+
+    print(json.dumps(batching_benchmark.remote(model_id, segments=segments), indent=2))
+
+
+def retry_segment(whisper, start: float, end: float, audio_filepath, regions, error):
+    logger.warning(f"Segment {start:.2f}-{end:.2f} failed ({error}), retrying")
+    return SEGMENT_RETRY.call(
+        whisper.transcribe_segment.remote, start, end, audio_filepath, regions
+    )
+
+
+def no_speech_segment(start: float, end: float) -> dict:
+    return {"start": start, "end": end, "chunks": [], "speech_secs": 0.0}
+
+
+def segment_bounds(start: float, end: float) -> tuple[float, float]:
+    return round(start, 3), round(end, 3)
+
+
+def transcribed_segment(result: dict, metrics: dict | None = None) -> dict:
+    segment = {
+        "start": result["start"],
+        "end": result["end"],
+        "chunks": result["chunks"],
+        # transcripts cached before VAD covered the whole segment
+        "speech_secs": result.get("speech_secs", result["end"] - result["start"]),
+    }
+    if metrics is not None:
+        segment["metrics"] = metrics
+    return segment
+
+
+def segment_metrics(
+    result: dict, backend: ASRBackend, dispatched_at: float | None = None
+) -> dict:
+    """
+    The transcribe_segment metrics row of a result. Time and cost are only
+    recorded for results transcribed since dispatched_at, not for cached
+    segments or those without speech.
+    """
+    from yt_university.services.metrics import asr_cost
+
+    metrics = {
+        "stage": "transcribe_segment",
+        "audio_secs": result["end"] - result["start"],
+        "details": {
+            "start": result["start"],
+            "end": result["end"],
+            "speech_secs": result.get("speech_secs"),
+            "backend": backend.name,
+        },
+    }
+    if dispatched_at is not None and "transcribe_secs" in result:
+        metrics.update(
+            wall_secs=result["transcribe_secs"],
+            queue_secs=max(result["started_at"] - dispatched_at, 0.0),
+            cost_usd=asr_cost(backend.name, result["model_secs"]),
+        )
+    return metrics
+
+
+class SpeechTally:
+    """
+    Audio seconds sent to Whisper against the audio seconds transcribed, for
+    reporting what VAD saved on a video.
+    """
+
+    def __init__(self):
+        self.audio_secs = 0.0
+        self.speech_secs = 0.0
+
+    def add(self, segment: dict) -> dict:
+        self.audio_secs += segment["end"] - segment["start"]
+        self.speech_secs += segment["speech_secs"]
+        return segment
+
+    def saved(self) -> float:
+        return 1 - self.speech_secs / self.audio_secs if self.audio_secs else 0.0
+
+    def log(self, name: str):
+        logger.info(
+            f"Sent {self.speech_secs:.0f}s of {self.audio_secs:.0f}s of {name} "
+            f"to Whisper, {self.saved():.1%} of GPU time saved by VAD"
+        )
 
 
 @stub.function(image=image, volumes={DATA_DIR: volume}, timeout=900, keep_warm=1)
-def transcribe(
-    audio_filepath: Path,
-):
-    segment_gen = split_silences(str(audio_filepath))
-    output_segments = []
+def transcribe(audio_filepath: Path, done: list | None = None):
+    """
+    Transcribe an audio file, yielding {"start", "end", "chunks"} for each
+    segment as soon as it completes, in completion order. Segments with
+    bounds in done were stored by an earlier run and are skipped.
+
+    Each segment carries its segment_metrics under "metrics", and a
+    {"metrics": ...} item without a segment reports the segmentation stage.
+    """
+    import time
+
+    t0 = time.time()
+    pcm_path = f"{os.path.splitext(str(audio_filepath))[0]}.pcm"
+
+    volume.reload()
+    if not os.path.exists(f"{pcm_path}.done"):
+        # decode once, the segments are then read straight from the PCM file
+        decode_pcm(str(audio_filepath), pcm_path)
+
+    # the whole plan is needed up front, so that no segment becomes a straggler
+    segments = plan_segments(energy_silences(pcm_path))
+    logger.info(
+        f"Planned {len(segments)} segments for {audio_filepath}: "
+        f"{simulate_makespan(segments, TRANSCRIBE_PARALLELISM)}"
+    )
 
-    whisper = Whisper()
+    whisper, backend = get_transcriber(segments[-1][1] if segments else None)
+
+    done = {segment_bounds(*bounds) for bounds in done or []}
+    todo = [segment for segment in segments if segment_bounds(*segment) not in done]
+
+    digest = pcm_digest(pcm_path)
+    noise_floor = NoiseFloor(pcm_path)
+    tally = SpeechTally()
+    pending = []
+    for start, end in todo:
+        cached = load_cached_segment(segment_cache_path(digest, backend, start, end))
+        if cached is not None:
+            result = {**cached, "start": start, "end": end}
+            yield tally.add(
+                transcribed_segment(result, segment_metrics(result, backend))
+            )
+            continue
+
+        regions = vad_regions(pcm_path, start, end, noise_floor)
+        if regions == []:
+            # nothing but non-speech, Whisper is not called at all
+            result = no_speech_segment(start, end)
+            yield tally.add(
+                transcribed_segment(result, segment_metrics(result, backend))
+            )
+        else:
+            pending.append((start, end, pcm_path, regions))
+    logger.info(
+        f"{len(segments) - len(todo)} of {len(segments)} segments stored, "
+        f"{len(todo) - len(pending)} cached or without speech"
+    )
+    # decoding, silence detection, planning and VAD
+    yield {
+        "metrics": {
+            "stage": "segmentation",
+            "wall_secs": time.time() - t0,
+            "audio_secs": segments[-1][1] if segments else 0.0,
+            "details": {"segments": len(segments), "pending": len(pending)},
+        }
+    }
+
+    dispatched_at = time.time()
+
+    # a failed segment comes back as its exception, so only it is retried
+    received = set()
     for result in whisper.transcribe_segment.starmap(
-        segment_gen, kwargs=dict(audio_filepath=audio_filepath)
+        pending, order_outputs=False, return_exceptions=True
     ):
-        output_segments.extend(result["chunks"])
+        if isinstance(result, Exception):
+            logger.warning(f"Segment failed: {result}")
+            continue
+        received.add(segment_bounds(result["start"], result["end"]))
+        store_segment(
+            segment_cache_path(digest, backend, result["start"], result["end"]), result
+        )
+        yield tally.add(
+            transcribed_segment(result, segment_metrics(result, backend, dispatched_at))
+        )
 
-    return {
-        "chunks": output_segments,
-        "language": "en",
-    }
+    for start, end, _, regions in pending:
+        if segment_bounds(start, end) in received:
+            continue
+        dispatched_at = time.time()
+        result = retry_segment(whisper, start, end, pcm_path, regions, "no result")
+        store_segment(segment_cache_path(digest, backend, start, end), result)
+        yield tally.add(
+            transcribed_segment(result, segment_metrics(result, backend, dispatched_at))
+        )
 
+    tally.log(str(audio_filepath))
+    volume.commit()
 
-def split_silences(
-    path: str, min_segment_length: float = 480.0, min_silence_length: float = 1.0
-) -> Iterator[tuple[float, float]]:
+
+def stream_pcm_path(video_url: str) -> str:
+    from yt_university.helper import get_youtube_video_id
+
+    return f"{DATA_DIR}{get_youtube_video_id(video_url)}.pcm"
+
+
+@stub.function(image=image, volumes={DATA_DIR: volume}, timeout=900)
+def transcribe_stream(video_url: str, done: list | None = None):
     """
-    Split audio file into contiguous chunks using the ffmpeg `silencedetect` filter.
-    Yields tuples (start, end) of each chunk in seconds.
+    Transcribe a video while its audio is still being fetched, yielding
+    segments like transcribe. The audio ends up at stream_pcm_path.
+
+    Segments are dispatched to Whisper as soon as they have been decoded and
+    a cut point found, instead of after the whole download. The segmentation
+    metrics, which include the download, are reported once it ends.
     """
+    import time
 
-    import re
+    t0 = time.time()
+    pcm_path = stream_pcm_path(video_url)
+    done = {segment_bounds(*bounds) for bounds in done or []}
 
-    import ffmpeg
+    # the duration is unknown until the stream ends
+    whisper, backend = get_transcriber()
+    # of the audio decoded so far, the quietest stretch can only get quieter
+    noise_floor = NoiseFloor(pcm_path)
+    calls = []
+    audio_secs = 0.0
+    # the plan can't be balanced before the length is known, cut greedily
+    for start, end in greedy_segments(stream_silences(video_url, pcm_path)):
+        audio_secs = end
+        if segment_bounds(start, end) in done:
+            continue
+        # the audio up to end is on the volume already
+        regions = vad_regions(pcm_path, start, end, noise_floor)
+        call = None
+        if regions != []:
+            call = whisper.transcribe_segment.spawn(start, end, pcm_path, regions)
+        calls.append((call, time.time(), (start, end, regions)))
+    yield {
+        "metrics": {
+            "stage": "segmentation",
+            "wall_secs": time.time() - t0,
+            "audio_secs": audio_secs,
+            "details": {"segments": len(calls), "streamed": True},
+        }
+    }
 
-    silence_end_re = re.compile(
-        r" silence_end: (?P<end>[0-9]+(\.?[0-9]*)) \| silence_duration: (?P<dur>[0-9]+(\.?[0-9]*))"
-    )
-    metadata = ffmpeg.probe(path)
-    duration = float(metadata["format"]["duration"])
+    # the audio hash is only known now, results are cached but never looked up
+    digest = pcm_digest(pcm_path)
+    tally = SpeechTally()
 
-    try:
-        reader = (
-            ffmpeg.input(str(path))
-            .filter("silencedetect", n="-10dB", d=min_silence_length)
-            .output("pipe:", format="null")
-            .run_async(pipe_stderr=True)
+    for call, dispatched_at, (start, end, regions) in calls:
+        if call is None:
+            result = no_speech_segment(start, end)
+            yield tally.add(
+                transcribed_segment(result, segment_metrics(result, backend))
+            )
+            continue
+        try:
+            result = call.get()
+        except Exception as e:
+            dispatched_at = time.time()
+            result = retry_segment(whisper, start, end, pcm_path, regions, e)
+        store_segment(segment_cache_path(digest, backend, start, end), result)
+        yield tally.add(
+            transcribed_segment(result, segment_metrics(result, backend, dispatched_at))
         )
-    except Exception as e:
-        logger.error(f"FFmpeg error: {e.stderr}")
 
-    cur_start = 0.0
-    num_segments = 0
+    tally.log(video_url)
+    volume.commit()
 
+
+def stream_silences(
+    video_url: str, pcm_path: str, min_silence_length: float = 1.0
+) -> Iterator[float]:
+    """
+    Decode the audio of a YouTube video straight from its media URL, see
+    decode_silences.
+    """
+    import yt_dlp
+
+    with raise_unavailable(video_url):
+        with yt_dlp.YoutubeDL({"format": "bestaudio[ext=m4a]"}) as ydl:
+            info = ydl.extract_info(video_url, download=False)
+
+    headers = "".join(f"{k}: {v}\r\n" for k, v in info.get("http_headers", {}).items())
+    yield from decode_silences(
+        info["url"], pcm_path, min_silence_length, input_args=dict(headers=headers)
+    )
+
+
+def silence_points(reader) -> Iterator[float]:
+    """
+    Midpoints of the silences reported by an ffmpeg `silencedetect` process.
+    """
     while True:
         line = reader.stderr.readline().decode("utf-8")
         if not line:
             break
-        match = silence_end_re.search(line)
+        match = SILENCE_END_RE.search(line)
         if match:
             silence_end, silence_dur = match.group("end"), match.group("dur")
-            split_at = float(silence_end) - (float(silence_dur) / 2)
+            yield float(silence_end) - (float(silence_dur) / 2)
+
+
+def decode_silences(
+    source: str,
+    pcm_path: str,
+    min_silence_length: float = 1.0,
+    input_args: dict | None = None,
+) -> Iterator[float]:
+    """
+    Decode source into a raw PCM file on the volume, running `silencedetect`
+    in the same ffmpeg pass.
+
+    Yields the silences in seconds once the audio up to them is on the
+    volume, so it can be transcribed while the rest is still being decoded,
+    and finally the duration.
+    """
+    import queue
+    import threading
+    import time
+
+    import ffmpeg
+
+    reader = (
+        ffmpeg.input(source, **(input_args or {}))
+        .filter("silencedetect", n=f"{SILENCE_NOISE_DB}dB", d=min_silence_length)
+        .output(pcm_path, format=PCM_FORMAT, ac=1, ar=SAMPLE_RATE)
+        .overwrite_output()
+        .run_async(pipe_stderr=True)
+    )
+
+    def wait_for_audio(until: float):
+        needed = int(until * PCM_BYTES_PER_SEC)
+        while reader.poll() is None and (
+            not os.path.exists(pcm_path) or os.path.getsize(pcm_path) < needed
+        ):
+            time.sleep(0.1)
+        volume.commit()
 
-            if (split_at - cur_start) < min_segment_length:
-                continue
+    # stderr is drained in a thread, ffmpeg blocks once the pipe is full and
+    # would never write the audio wait_for_audio is waiting for
+    points = queue.Queue()
 
-            yield cur_start, split_at
-            cur_start = split_at
-            num_segments += 1
+    def read_points():
+        try:
+            for point in silence_points(reader):
+                points.put(point)
+        finally:
+            points.put(None)
+
+    threading.Thread(target=read_points, daemon=True).start()
+
+    while (split_at := points.get()) is not None:
+        wait_for_audio(split_at)
+        yield split_at
+
+    if reader.wait() != 0:
+        raise RuntimeError(f"Error decoding audio from {source}.")
+
+    mark_decoded(pcm_path)
+    yield os.path.getsize(pcm_path) / PCM_BYTES_PER_SEC
+
+
+def decode_pcm(source: str, pcm_path: str):
+    import ffmpeg
+
+    try:
+        (
+            ffmpeg.input(source)
+            .output(pcm_path, format=PCM_FORMAT, ac=1, ar=SAMPLE_RATE)
+            .overwrite_output()
+            .run(quiet=True)
+        )
+    except ffmpeg.Error as e:
+        raise RuntimeError(f"Error decoding audio from {source}: {e.stderr}")
+
+    mark_decoded(pcm_path)
+
+
+def mark_decoded(pcm_path: str):
+    """
+    Marks the file complete, an interrupted decode leaves it truncated. The
+    marker holds the file's hash, which keys the transcript cache.
+    """
+    with open(f"{pcm_path}.done", "w") as f:
+        f.write(file_digest(pcm_path))
+    volume.commit()
+
+
+def energy_silences(
+    pcm_path: str,
+    min_silence_length: float = 1.0,
+    noise_db: float = SILENCE_NOISE_DB,
+    chunk_secs: float = 600.0,
+) -> list[float]:
+    """
+    Vectorized equivalent of detect_silences for raw PCM files.
+
+    silencedetect compares every sample against the threshold, so a frame is
+    silent when its peak amplitude is below it. Frame RMS sits 3 dB under the
+    peak of a tone, so it would find silences silencedetect doesn't and shift
+    the cut points of the segment plan. The file is scanned through a
+    memory map a chunk at a time, keeping memory flat for long videos.
+
+    Returns the silences in seconds followed by the duration.
+    """
+    import numpy as np
+
+    audio = np.memmap(pcm_path, dtype=np.float32, mode="r")
+    frame = int(SAMPLE_RATE * SILENCE_FRAME_SECS)
+    num_frames = len(audio) // frame
+    chunk_frames = int(chunk_secs / SILENCE_FRAME_SECS)
+    threshold = 10 ** (noise_db / 20)
+
+    silent = np.empty(num_frames, dtype=bool)
+    for i in range(0, num_frames, chunk_frames):
+        n = min(chunk_frames, num_frames - i)
+        block = audio[i * frame : (i + n) * frame].reshape(n, frame)
+        silent[i : i + n] = np.abs(block).max(axis=1) < threshold
+
+    # run boundaries of silent frames, as frame indexes
+    edges = np.diff(np.concatenate(([0], silent.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    long_enough = (ends - starts) * SILENCE_FRAME_SECS >= min_silence_length
+    midpoints = (starts + ends)[long_enough] * SILENCE_FRAME_SECS / 2
+
+    return [*midpoints.tolist(), len(audio) / SAMPLE_RATE]
+
+
+def frame_power(audio, chunk_frames: int = 3000):
+    """
+    Mean square of each VAD frame of audio, a minute at a time so long
+    recordings are never squared in memory at once.
+    """
+    import numpy as np
+
+    frame = int(SAMPLE_RATE * VAD_FRAME_SECS)
+    num_frames = len(audio) // frame
+    powers = [
+        np.square(
+            audio[i * frame : min(i + chunk_frames, num_frames) * frame],
+            dtype=np.float64,
+        )
+        .reshape(-1, frame)
+        .mean(axis=1)
+        for i in range(0, num_frames, chunk_frames)
+    ]
+    return np.concatenate(powers) if powers else np.empty(0)
+
+
+class NoiseFloor:
+    """
+    Loudness of the quietest VAD_FLOOR_SECS of a recording, as far as it has
+    been decoded. Pauses between sentences anywhere in the recording set it,
+    so a segment that is mostly music still gets the floor of the room.
+
+    update only reads the frames added since its last call, for recordings
+    that grow while being transcribed.
+    """
+
+    def __init__(self, pcm_path: str):
+        import numpy as np
+
+        self.pcm_path = pcm_path
+        self.frames = 0
+        self.floor = float("inf")
+        # frames whose windows are not complete yet
+        self.tail = np.empty(0)
+
+    def update(self, until: float = float("inf")) -> float:
+        """
+        The floor over the first until seconds, all that is decoded by default.
+        """
+        import numpy as np
+
+        audio = np.memmap(self.pcm_path, dtype=np.float32, mode="r")
+        frame = int(SAMPLE_RATE * VAD_FRAME_SECS)
+        window = int(VAD_FLOOR_SECS / VAD_FRAME_SECS)
+
+        end_frame = int(min(until * SAMPLE_RATE, len(audio))) // frame
+        if end_frame <= self.frames:
+            return self.floor
+
+        powers = np.concatenate(
+            (self.tail, frame_power(audio[self.frames * frame : end_frame * frame]))
+        )
+        if len(powers) >= window:
+            means = np.convolve(powers, np.ones(window) / window, mode="valid")
+            self.floor = min(self.floor, 10 * np.log10(means.min() + 1e-10))
+        self.tail = powers[len(powers) - window + 1 :]
+        self.frames = end_frame
+        return self.floor
+
+
+def speech_regions(
+    pcm_path: str,
+    start: float,
+    end: float,
+    floor: float | None = None,
+    margin_db: float = VAD_MARGIN_DB,
+    modulation_db: float = VAD_MODULATION_DB,
+    min_gap: float = VAD_MIN_GAP_SECS,
+    pad: float = VAD_PAD_SECS,
+) -> list[tuple[float, float]]:
+    """
+    Regions of a segment of a raw PCM file that may hold speech, in seconds
+    on the original timeline.
+
+    A frame counts as speech when it is margin_db over the recording's noise
+    floor, see NoiseFloor, and the loudness around it fluctuates like
+    syllables do, so dead air, room tone and steady music beds are left out.
+    Regions are padded and only gaps of at least min_gap are dropped, erring
+    towards keeping audio. A segment with loud frames but no region is kept
+    whole, rather than risk dropping speech the modulation test missed.
+    """
+    import numpy as np
+
+    audio = np.memmap(pcm_path, dtype=np.float32, mode="r")
+    audio = audio[int(start * SAMPLE_RATE) : int(end * SAMPLE_RATE)]
+    power = frame_power(audio)
+    if not len(power):
+        return []
+
+    db = 10 * np.log10(power + 1e-10)
+    if floor is None:
+        floor = NoiseFloor(pcm_path).update()
+    # a recording shorter than the floor's window
+    floor = min(floor, db.min())
+    loud = db > max(floor + margin_db, VAD_MIN_DB)
+
+    # standard deviation of the loudness over the surrounding second
+    window = np.ones(int(1 / VAD_FRAME_SECS)) / int(1 / VAD_FRAME_SECS)
+    mean = np.convolve(db, window, mode="same")
+    spread = np.sqrt(np.maximum(np.convolve(db**2, window, mode="same") - mean**2, 0))
+
+    edges = np.diff(np.concatenate(([0], (loud & (spread >= modulation_db)), [0])))
+    starts = np.flatnonzero(edges == 1) * VAD_FRAME_SECS - pad
+    ends = np.flatnonzero(edges == -1) * VAD_FRAME_SECS + pad
+
+    duration = len(audio) / SAMPLE_RATE
+    if not len(starts) and loud.any():
+        return [(start, start + duration)]
+
+    regions = []
+    for region_start, region_end in zip(starts.tolist(), ends.tolist()):
+        if regions and region_start - regions[-1][1] < min_gap:
+            regions[-1][1] = region_end
+        else:
+            regions.append([region_start, region_end])
+
+    # gaps too short to drop at either end are kept as well
+    if regions and regions[0][0] < min_gap:
+        regions[0][0] = 0.0
+    if regions and duration - regions[-1][1] < min_gap:
+        regions[-1][1] = duration
+
+    return [
+        (start + max(region_start, 0.0), start + min(region_end, duration))
+        for region_start, region_end in regions
+    ]
+
+
+def vad_regions(
+    pcm_path: str, start: float, end: float, noise_floor: NoiseFloor | None = None
+):
+    """
+    Speech regions to transcribe of a segment, or None to transcribe all of it.
+    Pass the NoiseFloor of the recording when calling this for each segment.
+    """
+    if not VAD_FILTER:
+        return None
+    floor = noise_floor.update() if noise_floor else None
+    return speech_regions(pcm_path, start, end, floor)
+
+
+def silence_test_pcm(path: str, burst_secs: float = 2.0) -> float:
+    """
+    Write raw PCM of tone bursts separated by quieter tones, with levels just
+    either side of SILENCE_NOISE_DB and gaps just either side of a second, so
+    silence detectors that round differently disagree on it. Returns the
+    duration written in seconds.
+    """
+    import numpy as np
+
+    threshold = 10 ** (SILENCE_NOISE_DB / 20)
+    gap_secs = (0.5, 0.9, 0.97, 1.03, 1.1, 1.5, 3.0)
+    # loud and barely over the threshold, barely under it and quiet
+    burst_levels = (1.6 * threshold, 1.1 * threshold)
+    gap_levels = (0.9 * threshold, 0.3 * threshold)
+
+    def tone(secs: float, amplitude: float, pitch: float):
+        t = np.arange(int(secs * SAMPLE_RATE)) / SAMPLE_RATE
+        return amplitude * np.sin(2 * np.pi * pitch * t)
+
+    parts = [tone(burst_secs, burst_levels[0], 300)]
+    for i, gap in enumerate(gap_secs * 2):
+        parts.append(tone(gap, gap_levels[i % 2], 220))
+        parts.append(tone(burst_secs, burst_levels[i // 2 % 2], 300))
+
+    audio = np.concatenate(parts).astype(np.float32)
+    with open(path, "wb") as f:
+        f.write(audio.tobytes())
+    return len(audio) / SAMPLE_RATE
+
+
+@stub.function(image=image, volumes={DATA_DIR: volume}, timeout=900)
+def silence_parity(audio_filepath: str = "", tolerance: float = 0.05) -> dict:
+    """
+    Compare energy_silences against ffmpeg's silencedetect on the same audio,
+    the signal of silence_test_pcm unless an audio file on the volume is given.
+    """
+    import tempfile
+    import time
+
+    if audio_filepath:
+        pcm_path = f"{os.path.splitext(audio_filepath)[0]}.pcm"
+        volume.reload()
+        if not os.path.exists(f"{pcm_path}.done"):
+            decode_pcm(audio_filepath, pcm_path)
+    else:
+        pcm_path = os.path.join(tempfile.mkdtemp(), "silences.pcm")
+        silence_test_pcm(pcm_path)
+
+    t0 = time.time()
+    expected = list(detect_silences(pcm_path))
+    ffmpeg_secs = time.time() - t0
+
+    t0 = time.time()
+    actual = energy_silences(pcm_path)
+    numpy_secs = time.time() - t0
+
+    errors = [
+        min((abs(point - other) for other in actual), default=float("inf"))
+        for point in expected
+    ]
+    expected_plan, actual_plan = plan_segments(expected), plan_segments(actual)
+    return {
+        "ffmpeg_points": len(expected),
+        "numpy_points": len(actual),
+        "max_error_secs": max(errors, default=0.0),
+        "mismatched": sum(1 for error in errors if error > tolerance),
+        "ffmpeg_secs": ffmpeg_secs,
+        "numpy_secs": numpy_secs,
+        "plans_match": len(expected_plan) == len(actual_plan)
+        and all(
+            abs(a - b) <= tolerance
+            for segments in zip(expected_plan, actual_plan)
+            for a, b in zip(*segments)
+        ),
+    }
+
+
+@stub.local_entrypoint()
+def parity(audio_filepath: str = ""):
+    result = silence_parity.remote(audio_filepath)
+    print(result)
+    if (
+        result["mismatched"]
+        or result["ffmpeg_points"] != result["numpy_points"]
+        or not result["plans_match"]
+    ):
+        raise SystemExit("energy_silences does not match silencedetect")
+
+
+def detect_silences(path: str, min_silence_length: float = 1.0) -> Iterator[float]:
+    """
+    Yields the silences of an audio file in seconds, and finally its duration.
+    """
+    import ffmpeg
+
+    input_args = {}
+    if path.endswith(".pcm"):
+        # raw PCM has no header to probe
+        duration = os.path.getsize(path) / PCM_BYTES_PER_SEC
+        input_args = dict(format=PCM_FORMAT, ar=SAMPLE_RATE, ac=1)
+    else:
+        metadata = ffmpeg.probe(path)
+        duration = float(metadata["format"]["duration"])
+
+    try:
+        reader = (
+            ffmpeg.input(str(path), **input_args)
+            .filter("silencedetect", n=f"{SILENCE_NOISE_DB}dB", d=min_silence_length)
+            .output("pipe:", format="null")
+            .run_async(pipe_stderr=True)
+        )
+    except Exception as e:
+        logger.error(f"FFmpeg error: {e.stderr}")
 
     # silencedetect can place the silence end *after* the end of the full audio segment.
     # Such segments definitions are negative length and invalid.
-    if duration > cur_start:
-        yield cur_start, duration
+    for split_at in silence_points(reader):
+        if split_at < duration:
+            yield split_at
+    yield duration
+
+
+def split_silences(
+    path: str, min_segment_length: float = 480.0, min_silence_length: float = 1.0
+) -> Iterator[tuple[float, float]]:
+    """
+    Split audio file into contiguous chunks using the ffmpeg `silencedetect` filter.
+    Yields tuples (start, end) of each chunk in seconds.
+    """
+    num_segments = 0
+    for segment in greedy_segments(
+        detect_silences(path, min_silence_length), min_segment_length
+    ):
+        yield segment
         num_segments += 1
     logger.info(f"Split {path} into {num_segments} segments")
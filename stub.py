@@ -2,13 +2,22 @@ from modal import Dict, Image, Secret, Stub, asgi_app
 
 stub = Stub("yt-university")
 
-in_progress = Dict.from_name("progress", create_if_missing=True)
+batches = Dict.from_name("batches", create_if_missing=True)
+scheduler_state = Dict.from_name("scheduler", create_if_missing=True)
+stage_calls = Dict.from_name("stage-calls", create_if_missing=True)
 
 shared_webapp_image = (
     Image.debian_slim(python_version="3.10")
     .apt_install("libpq-dev")
     .pip_install(
-        "python-dotenv", "psycopg2", "asyncpg", "sqlalchemy", "supabase", "svix"
+        "python-dotenv",
+        "psycopg2",
+        "asyncpg",
+        "sqlalchemy",
+        "supabase",
+        "svix",
+        "numpy",
+        "pgvector",
     )
 )
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules import each other as yt_university.*, the checkout is that package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
@@ -0,0 +1,87 @@
+import asyncio
+
+from sqlalchemy.exc import MissingGreenlet
+
+from yt_university.crud.feed import get_user_feed
+
+
+class ExpiringUser:
+    """
+    Stands in for a User loaded by an AsyncSession with expire_on_commit,
+    whose attributes can't be lazy loaded once a commit expired them.
+    """
+
+    def __init__(self, **columns):
+        self.__dict__["columns"] = columns
+        self.__dict__["expired"] = False
+
+    def __getattr__(self, name):
+        if self.expired:
+            raise MissingGreenlet(f"{name} expired on commit")
+        return self.columns[name]
+
+    def __setattr__(self, name, value):
+        self.columns[name] = value
+
+    def expire(self):
+        self.__dict__["expired"] = True
+
+
+class Video:
+    def __init__(self, id):
+        self.id = id
+
+
+class Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def all(self):
+        return self.rows
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+
+class Session:
+    def __init__(self, user, results):
+        self.user = user
+        self.results = [Result([user]), *map(Result, results)]
+        self.commits = 0
+
+    async def execute(self, statement):
+        return self.results.pop(0)
+
+    async def commit(self):
+        self.commits += 1
+        self.user.expire()
+
+
+def test_feed_after_rebuilding_a_cold_cache():
+    user = ExpiringUser(
+        id="user", embedding_sum=None, embedding_count=None, embedding_video_ids=None
+    )
+    session = Session(
+        user,
+        [
+            # the favorites and playlist videos the sum is rebuilt from
+            [("seen-1", [1.0, 0.0]), ("seen-2", [1.0, 0.2])],
+            # the pool closest to the rebuilt sum
+            [("near", [1.0, 0.1]), ("far", [0.0, 1.0])],
+            [Video("near"), Video("far")],
+        ],
+    )
+
+    feed = asyncio.run(get_user_feed(session, "user", limit=2, diversity=0.0))
+
+    assert session.commits == 1
+    assert user.columns["embedding_count"] == 2
+    assert user.columns["embedding_sum"] == [2.0, 0.2]
+    assert [video["id"] for video in feed] == ["near", "far"]
+    assert feed[0]["score"] > feed[1]["score"]
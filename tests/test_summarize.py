@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from yt_university.services import summarize
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    stored = {}
+
+    async def load_cached_completion(kind, inputs, use_cache=True):
+        return stored.get(kind)
+
+    async def store_completion(kind, inputs, output):
+        stored[kind] = output
+
+    monkeypatch.setattr(summarize, "load_cached_completion", load_cached_completion)
+    monkeypatch.setattr(summarize, "store_completion", store_completion)
+    return stored
+
+
+def test_malformed_summary_is_not_cached(cache):
+    async def truncated():
+        return '{"tl;dr": "cut off'
+
+    with pytest.raises(ValueError):
+        asyncio.run(
+            summarize.cached_completion(
+                "summary", [], truncated, validate=summarize.summary_columns
+            )
+        )
+    assert cache == {}
+
+
+def test_valid_summary_is_cached(cache):
+    async def complete():
+        return '{"tl;dr": "short"}'
+
+    output = asyncio.run(
+        summarize.cached_completion(
+            "summary", [], complete, validate=summarize.summary_columns
+        )
+    )
+    assert cache == {"summary": output}
@@ -0,0 +1,21 @@
+import pytest
+
+from yt_university.services.transcribe import energy_silences, silence_test_pcm
+
+
+def test_energy_silences_of_test_signal(tmp_path):
+    pcm_path = str(tmp_path / "silences.pcm")
+    duration = silence_test_pcm(pcm_path, burst_secs=2.0)
+
+    # gaps of a second or more are silences, whether their tone is barely
+    # under the threshold or quiet, and bursts barely over it are not
+    expected, position = [], 2.0
+    for gap in (0.5, 0.9, 0.97, 1.03, 1.1, 1.5, 3.0) * 2:
+        if gap >= 1.0:
+            expected.append(position + gap / 2)
+        position += gap + 2.0
+
+    silences = energy_silences(pcm_path)
+    assert silences[-1] == pytest.approx(duration)
+    # frames are 10ms, a partly silent one at either end of a gap is not silent
+    assert silences[:-1] == pytest.approx(expected, abs=0.01)
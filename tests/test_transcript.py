@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+from yt_university.crud.transcript import transcript_gaps
+
+
+def segment(start, end):
+    return SimpleNamespace(start=start, end=end)
+
+
+def test_rounded_metadata_duration_is_not_a_gap():
+    segments = [segment(0.0, 300.0), segment(300.0, 612.437)]
+
+    assert transcript_gaps(segments, 612.437) == []
+    # yt-dlp rounds the duration to the second
+    assert transcript_gaps(segments, 613, duration_error=1.0) == []
+    assert transcript_gaps(segments, 613) == [(612.437, 613.0)]
+
+
+def test_missing_segments_are_gaps():
+    segments = [segment(0.0, 300.0), segment(600.0, 900.0)]
+
+    assert transcript_gaps(segments, 1200.0, duration_error=1.0) == [
+        (300.0, 600.0),
+        (900.0, 1200.0),
+    ]